@@ -1,18 +1,64 @@
-from flask import Flask, jsonify, send_from_directory, request
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import requests
+from flask import Flask, Response, jsonify, send_file, send_from_directory, request, stream_with_context
 from flask_cors import CORS
 from pdf_service import PDFService, PlaceMapService
 from schedule_service import ScheduleService
+from timetable_model import parse_time, parse_weekdays
+from metrics import REGISTRY
+from refresh_service import RefreshWorker
+from gtfs_export import GtfsExporter
+from my_citi_pdf_service import TimetableExtractor
+from response_cache import ResponseCache
+
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 
 pdf_service = PDFService()
-place_service = PlaceMapService()
+schedule_service = ScheduleService(pdf_service)
+refresh_worker = RefreshWorker(schedule_service)
+# Serialized, compressed bodies of /extract, /places and /schedules, keyed by data version
+response_cache = ResponseCache()
+gtfs_exporter = GtfsExporter(schedule_service, TimetableExtractor(snapshot_path=None))
+# Nothing is started or loaded at import in a child process: spawned extraction workers
+# re-import this module (as __mp_main__ under `python app.py`)
+if os.environ.get('SCRAPPER_PRELOAD') == '1' and multiprocessing.parent_process() is None:
+    # gunicorn.conf.py: load the index once in the master so the forked workers share it;
+    # the refresh thread is started in each worker after the fork
+    schedule_service.get_route_index()
 app = Flask(__name__)
 CORS(app)
 
 
+# The refresh thread is started with the first request rather than at import;
+# set REFRESH_WORKER to False to serve the index as loaded (e.g. in benchmarks)
+app.config.setdefault('REFRESH_WORKER', True)
+
+
+@app.before_request
+def start_refresh_worker():
+    if app.config['REFRESH_WORKER']:
+        refresh_worker.start()
+
+# Upper bound on the number of queries in one /schedules/batch request
+BATCH_LIMIT = int(os.environ.get('SCHEDULES_BATCH_LIMIT', 1000))
+# Upper bound on the number of names one /places/suggest request returns
+SUGGEST_LIMIT = 50
+
+
+# Served from the cached link listing; gabs.co.za is only hit when the listing is missing or stale
 @app.route('/files', methods=['GET'])
 def list_files():
-    return jsonify({'files': pdf_service.fetch_pdf_links()})
+    try:
+        return jsonify({'files': pdf_service.cached_pdf_links()})
+    except requests.RequestException as e:
+        return jsonify({"error": f"Could not fetch the timetable links: {e}"}), 502
 
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
@@ -22,20 +68,69 @@ def download_file(filename):
 def list_all_files():
     return jsonify({'files': pdf_service.list_downloaded_pdfs()})
 
+# Starts a background refresh (fetch links, download changes, re-extract, swap index) and returns its job
 @app.route('/download-all', methods=['GET'])
+@app.route('/refresh', methods=['POST'])
 def download_all():
-    files = pdf_service.download_pdfs()
-    return jsonify({'status': 'Download complete', 'files': files})
+    job = refresh_worker.trigger()
+    response = jsonify({'status': 'Refresh started', 'job': job.to_dict()})
+    response.headers['Location'] = f'/refresh/{job.id}'
+    return response, 202
+
+@app.route('/refresh/<job_id>', methods=['GET'])
+def refresh_status(job_id):
+    job = refresh_worker.get_job(job_id)
+    if not job:
+        return jsonify({"error": f"Unknown refresh job {job_id}"}), 404
+    return jsonify({'job': job.to_dict()})
 
+# Served from the extraction cache; the body is built once per version of the PDF
 @app.route('/extract/<filename>', methods=['GET'])
 def extract_from_pdf(filename):
-    places = place_service.extract_text_from_pdf(filename)
-    return jsonify({'places': places, 'placesMap': place_service.places_map})
+    # Only downloaded timetables, by the same rule as list_downloaded_pdfs
+    pdf_path = os.path.join(pdf_service.download_folder, filename)
+    if filename.startswith('.') or not filename.lower().endswith('.pdf') or not os.path.isfile(pdf_path):
+        return jsonify({"error": f"Unknown timetable {filename}"}), 404
+    stat = os.stat(pdf_path)
+    version = (PlaceMapService.PARSER_VERSION, stat.st_size, stat.st_mtime_ns)
+    return response_cache.respond(version, ('extract', filename),
+                                  lambda: (schedule_service.extract_route_data(filename), 200))
+
+
+def parse_time_value(name, value):
+    if not value:
+        return None
+    parsed = parse_time(value) if isinstance(value, str) else None
+    if not parsed or parsed[1] or parsed[0] >= 24 * 60:
+        raise ValueError(f"{name} must be a time in HH:MM format")
+    return parsed[0]
+
+
+def parse_time_param(name):
+    return parse_time_value(name, request.args.get(name))
+
+
+def parse_date_value(value):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError("date must be a date in YYYY-MM-DD format")
+
+
+# A day name like 'saturday' or 'Saturdays' as a weekday number (Monday = 0)
+def parse_day_value(value):
+    if not value:
+        return None
+    weekdays = parse_weekdays(value) if isinstance(value, str) else ()
+    if len(weekdays) != 1:
+        raise ValueError("day must be the name of a day of the week")
+    return weekdays[0]
 
 
 @app.route('/schedules', methods=['GET'])
 def get_schedule():
-    schedule_service = ScheduleService()
     # Get user location and destination from query parameters
     user_location = request.args.get('user_location')
     dest = request.args.get('destination')
@@ -43,26 +138,122 @@ def get_schedule():
     if not user_location or not dest:
         return jsonify({"error": "Missing user_location or destination"}), 400
 
-    # Call the method to get times for the given locations
-    times = schedule_service.find_times_for_location_and_destination(user_location, dest)
-    
-    # If times were found, return them in the response, otherwise, return a message
-    if times:
-        return jsonify({"times": times}), 200
-    else:
-        return jsonify({"message": f"No schedule found for {user_location} to {dest}."}), 404
+    # Optional next-departures mode: ?after=HH:MM&before=HH:MM&limit=N, for the timetables in force
+    # on ?date=YYYY-MM-DD (default today) and only the departures running that date or ?day=saturday
+    try:
+        after = parse_time_param('after')
+        before = parse_time_param('before')
+        date = parse_date_value(request.args.get('date'))
+        weekday = parse_day_value(request.args.get('day'))
+        limit = request.args.get('limit', type=int)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if 'limit' in request.args and (limit is None or limit < 1):
+        return jsonify({"error": "limit must be a positive integer"}), 400
+
+    def build():
+        # Call the method to get times for the given locations
+        times = schedule_service.find_times_for_location_and_destination(user_location, dest, after, before, limit,
+                                                                         date, weekday)
+
+        # If times were found, return them in the response, otherwise, return a message
+        if isinstance(times, list):
+            return {"times": times}, 200
+        else:
+            return {"message": f"No schedule found for {user_location} to {dest}."}, 404
+
+    # Without a date the answer is for today's timetables, so today is part of the key
+    key = ('schedules', user_location, dest, after, before, limit, date or datetime.date.today(), weekday)
+    return response_cache.respond(schedule_service.get_route_index().version, key, build)
+
+# Parses one entry of a batch request into a (user_location, destination, after, before, limit, date, weekday) query
+def parse_batch_query(entry):
+    if not isinstance(entry, dict):
+        raise ValueError("Each query must be an object")
+    user_location = entry.get('user_location')
+    dest = entry.get('destination')
+    if not isinstance(user_location, str) or not isinstance(dest, str) or not user_location or not dest:
+        raise ValueError("Missing user_location or destination")
+    limit = entry.get('limit')
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+        raise ValueError("limit must be a positive integer")
+    return (user_location, dest, parse_time_value('after', entry.get('after')),
+            parse_time_value('before', entry.get('before')), limit,
+            parse_date_value(entry.get('date')), parse_day_value(entry.get('day')))
+
+
+# Answers many origin/destination pairs in one request: takes {"queries": [{"user_location": ...,
+# "destination": ..., "after": "HH:MM", "before": "HH:MM", "limit": N, "date": "YYYY-MM-DD",
+# "day": "saturday"}, ...]} and streams one
+# NDJSON line per query, in order, each with the status /schedules would have answered it with
+@app.route('/schedules/batch', methods=['POST'])
+def get_schedule_batch():
+    body = request.get_json(silent=True)
+    entries = body.get('queries') if isinstance(body, dict) else body
+    if not isinstance(entries, list):
+        return jsonify({"error": "Expected a JSON body with a list of queries"}), 400
+    if len(entries) > BATCH_LIMIT:
+        return jsonify({"error": f"At most {BATCH_LIMIT} queries per batch"}), 413
+
+    queries, errors = [], {}
+    for i, entry in enumerate(entries):
+        try:
+            queries.append(parse_batch_query(entry))
+        except ValueError as e:
+            errors[i] = str(e)
+
+    def generate():
+        results = schedule_service.find_times_batch(queries)
+        for i, entry in enumerate(entries):
+            line = {'index': i}
+            if i in errors:
+                line.update(status=400, error=errors[i])
+            else:
+                user_location, dest = entry['user_location'], entry['destination']
+                times = next(results)
+                line.update(user_location=user_location, destination=dest)
+                if isinstance(times, list):
+                    line.update(status=200, times=times)
+                else:
+                    line.update(status=404, message=f"No schedule found for {user_location} to {dest}.")
+            yield json.dumps(line) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# The whole timetable as a GTFS static feed, rebuilt only for the PDFs that changed since the last export
+@app.route('/gtfs.zip', methods=['GET'])
+def gtfs_feed():
+    feed_path = os.path.abspath(gtfs_exporter.ensure_current())
+    return send_file(feed_path, mimetype='application/zip', as_attachment=True, download_name='gtfs.zip')
+
+# Prometheus scrape endpoint for the per-stage counters and latency histograms
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 # Create an endpoint to get all places
 @app.route('/places', methods=['GET'])
 def get_all_places():
-    schedule_service = ScheduleService()
-    places = schedule_service.get_all_places()
+    def build():
+        places = schedule_service.get_all_places()
+
+        if places:
+            return {"places": places}, 200
+        else:
+            return {"message": "No places available."}, 404
+
+    return response_cache.respond(schedule_service.get_route_index().version, ('places',), build)
 
-    if places:
-        return jsonify({"places": places})
-    else:
-        return jsonify({"message": "No places available."}), 404
+# Place names completing ?q= for a type-ahead picker, best first: ?q=gugu&limit=10
+@app.route('/places/suggest', methods=['GET'])
+def suggest_places():
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', type=int) if 'limit' in request.args else 10
+    if limit is None or not 1 <= limit <= SUGGEST_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {SUGGEST_LIMIT}"}), 400
+    return jsonify({"query": query, "places": schedule_service.suggest_places(query, limit)})
     
 if __name__ == '__main__':
+    refresh_worker.start()
     app.run(host='0.0.0.0', port=10000)
 
@@ -0,0 +1,128 @@
+"""Download load test of the GABS and MyCiti crawlers against the local stand-in servers.
+
+Run from the repository root:
+
+    python -m benchmarks.download_loadtest --concurrency 1,2,4,8 --latency 0.05
+    python -m benchmarks.download_loadtest --bandwidth 500000 --error-rate 0.1 --output benchmarks/downloads.json
+
+For every concurrency setting both crawls run twice into a fresh folder: cold
+(every PDF is downloaded) and warm (every PDF should come back as a 304).
+Wall time, throughput and the per-status counts are reported, together with
+the requests the server saw, so retries show up as requests beyond one per file.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_servers import FakeTimetableServer  # noqa: E402
+from download_service import DownloadEngine  # noqa: E402
+from my_citi_pdf_service import MyCitiPDFService  # noqa: E402
+from pdf_service import PDFService  # noqa: E402
+
+
+def downloader_for(folder, concurrency, args):
+    return DownloadEngine(folder, max_per_host=args.per_host or concurrency, max_workers=concurrency,
+                          max_retries=args.retries, backoff_factor=args.backoff, timeout=(5, args.timeout))
+
+
+def crawl_gabs(folder, base_url, downloader):
+    service = PDFService(folder, base_url=base_url, downloader=downloader)
+    return service.downloader.download_all(service.fetch_pdf_links())
+
+
+def crawl_myciti(folder, base_url, downloader):
+    return MyCitiPDFService(folder, base_url=base_url, downloader=downloader).download_all_pdfs()
+
+
+def run_crawl(crawl, server, concurrency, args):
+    """Runs one crawl cold and then warm into a fresh folder and returns both measurements."""
+    folder = tempfile.mkdtemp(prefix='loadtest_')
+    results = {}
+    try:
+        for phase in ('cold', 'warm'):
+            server.reset_stats()
+            # A new engine per phase, as after a restart; the validators come from the folder's metadata
+            downloader = downloader_for(folder, concurrency, args)
+            start = time.perf_counter()
+            statuses = crawl(folder, server.base_url, downloader)
+            wall = time.perf_counter() - start
+            downloader.session.close()
+
+            stats = dict(server.stats)
+            files = len(statuses)
+            results[phase] = {
+                'wall_s': wall,
+                'files': files,
+                'statuses': dict(Counter(statuses.values())),
+                'mb_per_s': stats.get('bytes_sent', 0) / wall / 1e6 if wall else 0.0,
+                'files_per_s': files / wall if wall else 0.0,
+                'server_requests': stats.get('requests', 0),
+                # Every path is asked for once per crawl; anything beyond that is a retry
+                'retries': sum(count - 1 for count in server.requests_per_path.values()),
+                'errors_injected': stats.get('errors_injected', 0),
+                'server_statuses': {key[len('status_'):]: value for key, value in stats.items()
+                                    if key.startswith('status_')},
+            }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pdf-folder', default='pdf_downloads', help='PDFs the stand-in servers publish')
+    parser.add_argument('--concurrency', default='1,2,4,8', help='comma separated download worker counts')
+    parser.add_argument('--per-host', type=int, default=None, help='parallel downloads per host (default: concurrency)')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff', type=float, default=0.05, help='retry backoff factor in seconds')
+    parser.add_argument('--timeout', type=float, default=60.0, help='read timeout in seconds')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the servers add to every response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes per second per response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    parser.add_argument('--no-etag', action='store_true', help='servers do not send or honour ETags')
+    parser.add_argument('--no-last-modified', action='store_true', help='servers do not send or honour Last-Modified')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    # Failed downloads are expected when injecting errors; keep their warnings out of the report
+    logging.basicConfig(level=logging.ERROR)
+
+    servers = {}
+    for site in ('gabs', 'myciti'):
+        servers[site] = FakeTimetableServer(args.pdf_folder, latency=args.latency, bandwidth=args.bandwidth,
+                                            error_rate=args.error_rate, etag=not args.no_etag,
+                                            last_modified=not args.no_last_modified, seed=args.seed).start()
+    crawls = {'gabs': crawl_gabs, 'myciti': crawl_myciti}
+
+    results = []
+    try:
+        for concurrency in (int(value) for value in args.concurrency.split(',')):
+            for site, crawl in crawls.items():
+                measured = run_crawl(crawl, servers[site], concurrency, args)
+                results.append({'site': site, 'concurrency': concurrency, **measured})
+                for phase in ('cold', 'warm'):
+                    m = measured[phase]
+                    print(f"{site:7} c={concurrency:<3} {phase:5} {m['wall_s']:8.3f}s {m['files_per_s']:8.1f} files/s "
+                          f"{m['mb_per_s']:8.2f} MB/s retries={m['retries']:<4} {json.dumps(m['statuses'])}")
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump({'args': vars(args), 'results': results}, output_file, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Local stand-ins for gabs.co.za and myciti.org.za, serving the PDFs in pdf_downloads/.
+
+Each server answers:
+
+    /Timetable.aspx                                  GABS listing with window.open download buttons
+    /Timetables/<file>.pdf                           a GABS timetable
+    /en/timetables/route-stop-station-timetables/    MyCiti route list
+    /docs/route-timetables/<code>-timetable.pdf      a MyCiti timetable
+
+MyCiti routes are made up (R01, R02, ...) and served from the same PDFs.
+Latency, bandwidth, the share of requests failing with a 503 and the ETag /
+Last-Modified behaviour are configurable, and every request is counted so a
+harness can see retries. Run one standalone and point the app at it:
+
+    python -m benchmarks.fake_servers --port 8001 --latency 0.05
+    GABS_BASE_URL=http://127.0.0.1:8001 MYCITI_BASE_URL=http://127.0.0.1:8001 python app.py
+"""
+import argparse
+import hashlib
+import html
+import os
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+GABS_LISTING = '/Timetable.aspx'
+GABS_PDF_PREFIX = '/Timetables/'
+MYCITI_LISTING = '/en/timetables/route-stop-station-timetables/'
+MYCITI_PDF_PREFIX = '/docs/route-timetables/'
+
+
+class FakeTimetableServer:
+    """A threaded HTTP server standing in for both timetable sites.
+
+    latency is added before every response (seconds), bandwidth caps the body
+    rate per response (bytes per second, None for unlimited) and error_rate is
+    the probability of answering a request with a 503 instead.
+    """
+
+    def __init__(self, pdf_folder='pdf_downloads', host='127.0.0.1', port=0, latency=0.0, bandwidth=None,
+                 error_rate=0.0, etag=True, last_modified=True, seed=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.etag = etag
+        self.last_modified = last_modified
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        self.requests_per_path = Counter()
+
+        self.files = {}
+        for name in sorted(os.listdir(pdf_folder)):
+            path = os.path.join(pdf_folder, name)
+            if name.startswith('.') or not name.lower().endswith('.pdf') or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as pdf_file:
+                content = pdf_file.read()
+            self.files[name] = (content, f'"{hashlib.sha1(content).hexdigest()}"',
+                                formatdate(os.stat(path).st_mtime, usegmt=True))
+        self.myciti_routes = {f'R{i:02d}': name for i, name in enumerate(self.files, 1)}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-timetable-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+            self.requests_per_path.clear()
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    # Pages
+
+    def gabs_listing(self):
+        buttons = ''.join(
+            f'<tr><td>{html.escape(name)}</td><td><button type="button" title="Download" class="btn" '
+            f'onclick="window.open(\'{GABS_PDF_PREFIX}{name}\')">Download</button></td></tr>\n'
+            for name in self.files)
+        return f'<html><head><title>Timetables</title></head><body><table>\n{buttons}</table></body></html>'
+
+    def myciti_listing(self):
+        routes = ''.join(
+            f'<div class="route column"><a href="/en/routes/{code}/">'
+            f'<span class="route-item-label">{code}</span>'
+            f'<span class="route-item-title">{html.escape(name[:-4].replace("_", " "))}</span></a></div>\n'
+            for code, name in self.myciti_routes.items())
+        return f'<html><body><div class="routes">\n{routes}</div></body></html>'
+
+    # Request handling
+
+    def handle(self, request):
+        path = unquote(urlparse(request.path).path)
+        with self._lock:
+            self.stats['requests'] += 1
+            self.requests_per_path[path] += 1
+            fail = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            self.count('errors_injected')
+            return self.respond(request, 503, b'Service Unavailable', 'text/plain')
+
+        if path == GABS_LISTING:
+            return self.respond(request, 200, self.gabs_listing().encode('utf-8'), 'text/html; charset=utf-8')
+        if path == MYCITI_LISTING:
+            return self.respond(request, 200, self.myciti_listing().encode('utf-8'), 'text/html; charset=utf-8')
+
+        name = None
+        if path.startswith(GABS_PDF_PREFIX):
+            name = path[len(GABS_PDF_PREFIX):]
+        elif path.startswith(MYCITI_PDF_PREFIX) and path.endswith('-timetable.pdf'):
+            name = self.myciti_routes.get(path[len(MYCITI_PDF_PREFIX):-len('-timetable.pdf')])
+        if name not in self.files:
+            return self.respond(request, 404, b'Not Found', 'text/plain')
+
+        content, etag, last_modified = self.files[name]
+        headers = {}
+        if self.etag:
+            headers['ETag'] = etag
+        if self.last_modified:
+            headers['Last-Modified'] = last_modified
+        if ((self.etag and request.headers.get('If-None-Match') == etag) or
+                (self.last_modified and not request.headers.get('If-None-Match')
+                 and request.headers.get('If-Modified-Since') == last_modified)):
+            return self.respond(request, 304, b'', None, headers)
+        return self.respond(request, 200, content, 'application/pdf', headers)
+
+    def respond(self, request, status, body, content_type, headers=None):
+        self.count(f'status_{status}')
+        request.send_response(status)
+        if content_type:
+            request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+
+        try:
+            if not self.bandwidth:
+                request.wfile.write(body)
+            else:
+                chunk_size = max(1024, int(self.bandwidth / 20))
+                for start in range(0, len(body), chunk_size):
+                    chunk = body[start:start + chunk_size]
+                    request.wfile.write(chunk)
+                    time.sleep(len(chunk) / self.bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        self.count('bytes_sent', len(body))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pdf-folder', default='pdf_downloads')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes per second per response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    parser.add_argument('--no-etag', action='store_true', help='do not send or honour ETags')
+    parser.add_argument('--no-last-modified', action='store_true', help='do not send or honour Last-Modified')
+    args = parser.parse_args()
+
+    server = FakeTimetableServer(args.pdf_folder, args.host, args.port, args.latency, args.bandwidth,
+                                 args.error_rate, not args.no_etag, not args.no_last_modified)
+    print(f"Serving {len(server.files)} timetables on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Offline benchmarks for the timetable pipeline over the PDFs in pdf_downloads/.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --output benchmarks/latest.json
+    python -m benchmarks.run_benchmarks --compare benchmarks/baseline.json
+
+Results are written as JSON so two runs can be compared; --compare prints the
+change per metric and exits non-zero when something regressed past --threshold.
+
+Queries are asked for one fixed --date, so they hit the timetables in force
+that day whatever day the benchmark runs. The HTTP benchmarks run once with
+the response cache bypassed (the query path) and once through it (cached).
+"""
+import argparse
+import datetime
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_service import PDFService, PlaceMapService  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+from schedule_service import ScheduleService  # noqa: E402
+
+
+# Metrics where a bigger number is better; everything else is a duration
+HIGHER_IS_BETTER = {'rps'}
+
+
+def percentiles(samples, scale=1.0):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def pick(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * scale
+
+    return {
+        'count': len(samples),
+        'min': samples[0] * scale,
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p99': pick(0.99),
+        'max': samples[-1] * scale,
+        'mean': statistics.fmean(samples) * scale,
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallows the services' prints and info logs so they neither skew timings nor mix with the results.
+
+    Warnings and errors are still logged.
+    """
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(max(level, logging.WARNING))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        root.setLevel(level)
+
+
+def bench_extraction(download_folder):
+    place_service = PlaceMapService(download_folder=download_folder)
+    per_document = {}
+    for pdf_name in sorted(PDFService(download_folder).list_downloaded_pdfs()):
+        start = time.perf_counter()
+        place_service.extract_text_from_pdf(pdf_name)
+        per_document[pdf_name] = time.perf_counter() - start
+    summary = percentiles(per_document.values(), scale=1000)
+    summary['total'] = sum(per_document.values()) * 1000
+    return {'extract_document_ms': summary}, {name: seconds * 1000 for name, seconds in per_document.items()}
+
+
+def bench_get_routes(download_folder):
+    cache_folder = tempfile.mkdtemp(prefix='bench_cache_')
+    try:
+        schedule_service = ScheduleService(PDFService(download_folder), snapshot_path=None, cache_folder=cache_folder)
+        with quiet():
+            start = time.perf_counter()
+            routes = schedule_service.get_routes()
+            cold = time.perf_counter() - start
+
+            start = time.perf_counter()
+            schedule_service.get_routes()
+            warm = time.perf_counter() - start
+    finally:
+        shutil.rmtree(cache_folder, ignore_errors=True)
+    return {
+        'get_routes_cold_ms': {'value': cold * 1000, 'routes': len(routes)},
+        'get_routes_warm_ms': {'value': warm * 1000, 'routes': len(routes)},
+    }
+
+
+def sample_queries(schedule_service, count, seed, date):
+    """Picks origin/destination pairs that share a route running on date, so every query has work to do."""
+    rng = random.Random(seed)
+    with quiet():
+        index = schedule_service.get_route_index()
+    in_force = index.in_force(date.strftime('%Y%m%d'))
+    places = [[index.place_table.name_of(place_id) for place_id in route.service.get(date.weekday(), {})]
+              for route_id, route in enumerate(index.routes) if route_id in in_force]
+    places = [route_places for route_places in places if len(route_places) > 1]
+    if not places:
+        raise SystemExit(f"No timetables in force with service on {date}; pick another --date")
+    queries = []
+    for _ in range(count):
+        origin, dest = rng.sample(rng.choice(places), 2)
+        queries.append((origin, dest))
+    return queries
+
+
+def bench_queries(schedule_service, queries, date):
+    latencies = []
+    found = 0
+    with quiet():
+        schedule_service.get_route_index()
+        for user_location, dest in queries:
+            start = time.perf_counter()
+            times = schedule_service.find_times_for_location_and_destination(user_location, dest, date=date)
+            latencies.append(time.perf_counter() - start)
+            found += isinstance(times, list)
+    summary = percentiles(latencies, scale=1_000_000)
+    summary['found'] = found
+    return {'query_latency_us': summary}
+
+
+def bench_http(flask_app, paths, concurrency, name):
+    """Fires the given paths at the Flask test client from `concurrency` threads."""
+    local = threading.local()
+    latencies = []
+    errors = 0
+    not_found = 0
+
+    def fetch(path):
+        if not hasattr(local, 'client'):
+            local.client = flask_app.test_client()
+        start = time.perf_counter()
+        response = local.client.get(path)
+        return time.perf_counter() - start, response.status_code
+
+    with quiet():
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for latency, status in executor.map(fetch, paths):
+                latencies.append(latency)
+                errors += status >= 500
+                not_found += status == 404
+        elapsed = time.perf_counter() - start
+
+    summary = percentiles(latencies, scale=1000)
+    summary['rps'] = len(paths) / elapsed if elapsed else 0.0
+    summary['errors'] = errors
+    summary['not_found'] = not_found
+    return {f'http_{name}_ms': summary}
+
+
+def run(args):
+    from urllib.parse import urlencode
+    import app
+
+    # A service over the requested folder, without the refresh worker or the snapshot
+    schedule_service = ScheduleService(PDFService(args.download_folder), snapshot_path=None)
+    app.schedule_service = schedule_service
+    app.app.config['REFRESH_WORKER'] = False
+    date = datetime.date.fromisoformat(args.date)
+
+    results = {}
+    per_document = {}
+    if not args.skip_extraction:
+        extraction, per_document = bench_extraction(args.download_folder)
+        results.update(extraction)
+        results.update(bench_get_routes(args.download_folder))
+
+    queries = sample_queries(schedule_service, args.queries, args.seed, date)
+    results.update(bench_queries(schedule_service, queries, date))
+
+    schedule_paths = ['/schedules?' + urlencode({'user_location': origin, 'destination': dest, 'date': args.date})
+                      for origin, dest in queries[:args.requests]]
+    # First with a cache that keeps nothing, so every request runs the query and serializes it
+    app.response_cache = ResponseCache(max_entries=0)
+    results.update(bench_http(app.app, schedule_paths, args.concurrency, 'schedules'))
+    results.update(bench_http(app.app, ['/places'] * args.requests, args.concurrency, 'places'))
+
+    # Then through a warmed response cache
+    app.response_cache = ResponseCache()
+    for path in set(schedule_paths) | {'/places'}:
+        app.app.test_client().get(path)
+    results.update(bench_http(app.app, schedule_paths, args.concurrency, 'schedules_cached'))
+    results.update(bench_http(app.app, ['/places'] * args.requests, args.concurrency, 'places_cached'))
+
+    return {
+        'meta': {
+            'timestamp': int(time.time()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'documents': len(per_document),
+            'queries': args.queries,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'date': args.date,
+        },
+        'results': results,
+        'per_document_ms': per_document,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Prints the change per metric and returns the names of the regressed ones."""
+    regressions = []
+    for metric, stats in sorted(current['results'].items()):
+        base_stats = baseline.get('results', {}).get(metric, {})
+        for stat in ('value', 'p50', 'p90', 'p99', 'total', 'rps'):
+            if stat not in stats or not base_stats.get(stat):
+                continue
+            change = (stats[stat] - base_stats[stat]) / base_stats[stat]
+            worse = -change if stat in HIGHER_IS_BETTER else change
+            flag = 'REGRESSION' if worse > threshold else ''
+            print(f"{metric:28} {stat:6} {base_stats[stat]:12.3f} -> {stats[stat]:12.3f} {change:+8.1%} {flag}")
+            if flag:
+                regressions.append(f'{metric}.{stat}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--download-folder', default='pdf_downloads')
+    parser.add_argument('--output', default='benchmarks/latest.json', help='where to write the results')
+    parser.add_argument('--compare', help='baseline results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown counted as a regression')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--date', default='2025-03-03', help='service date of the queries (YYYY-MM-DD)')
+    parser.add_argument('--skip-extraction', action='store_true', help='only run the query and HTTP benchmarks')
+    args = parser.parse_args()
+
+    current = run(args)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(current, output_file, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        for metric, stats in sorted(current['results'].items()):
+            print(metric, json.dumps({k: round(v, 3) for k, v in stats.items()}))
+
+
+if __name__ == '__main__':
+    main()
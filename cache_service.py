@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+class ExtractionCache:
+    """Persistent on-disk cache of data extracted from timetable PDFs.
+
+    Entries are keyed by the PDF path and validated against the file size,
+    mtime, content hash and the parser version that produced them, so only
+    new or modified PDFs have to be extracted again.
+    """
+
+    def __init__(self, parser_version, cache_folder='pdf_cache'):
+        self.parser_version = parser_version
+        self.cache_folder = cache_folder
+        os.makedirs(self.cache_folder, exist_ok=True)
+
+    def _entry_path(self, pdf_path):
+        digest = hashlib.sha1(os.path.normpath(pdf_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_folder, f"{digest}.json")
+
+    @staticmethod
+    def file_hash(pdf_path):
+        """Returns the sha256 hex digest of a file's contents."""
+        sha = hashlib.sha256()
+        with open(pdf_path, 'rb') as pdf_file:
+            for chunk in iter(lambda: pdf_file.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _read_entry(self, pdf_path):
+        try:
+            with open(self._entry_path(pdf_path), 'r', encoding='utf-8') as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, pdf_path, entry):
+        # Write to a temp file first so readers never see a half-written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as entry_file:
+                json.dump(entry, entry_file)
+            os.replace(tmp_path, self._entry_path(pdf_path))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, pdf_path):
+        """Returns the cached data for a PDF, or None if it is missing or stale."""
+        entry = self._read_entry(pdf_path)
+        if not entry or entry.get('parser_version') != self.parser_version:
+            return None
+        if entry.get('path') != os.path.normpath(pdf_path):
+            return None
+        try:
+            stat = os.stat(pdf_path)
+        except OSError:
+            return None
+        if entry['size'] != stat.st_size:
+            return None
+        if entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['data']
+
+        # Same size but touched (e.g. re-downloaded): trust the content hash
+        if self.file_hash(pdf_path) != entry['sha256']:
+            return None
+        entry['mtime_ns'] = stat.st_mtime_ns
+        self._write_entry(pdf_path, entry)
+        return entry['data']
+
+    def put(self, pdf_path, data):
+        """Stores the extracted data for a PDF."""
+        stat = os.stat(pdf_path)
+        entry = {
+            'path': os.path.normpath(pdf_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': self.file_hash(pdf_path),
+            'parser_version': self.parser_version,
+            'data': data,
+        }
+        self._write_entry(pdf_path, entry)
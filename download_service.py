@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import REGISTRY, stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadEngine:
+    """Shared downloader for timetable PDFs.
+
+    Uses one pooled requests session with retry/backoff, caps the number of
+    parallel downloads per host, sends If-None-Match / If-Modified-Since so
+    unchanged files come back as a 304, and writes each file to a temp file
+    that is renamed into place once complete.
+    """
+
+    META_FILE = '.download_meta.json'
+
+    def __init__(self, download_folder, max_per_host=4, max_workers=8, max_retries=3,
+                 backoff_factor=0.5, timeout=(5, 60), chunk_size=64 * 1024):
+        self.download_folder = download_folder
+        self.max_per_host = max_per_host
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        os.makedirs(self.download_folder, exist_ok=True)
+
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD']))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(max_per_host, max_workers), max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'Mozilla/5.0'
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self._meta = self._load_meta()
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.download_folder, self.META_FILE)
+
+    def _load_meta(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self):
+        # Called with self._lock held
+        fd, tmp_path = tempfile.mkstemp(dir=self.download_folder, prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as meta_file:
+            json.dump(self._meta, meta_file)
+        os.replace(tmp_path, self.meta_path)
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def _conditional_headers(self, file_name):
+        headers = {}
+        if not os.path.exists(os.path.join(self.download_folder, file_name)):
+            return headers
+        with self._lock:
+            validators = self._meta.get(file_name, {})
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def download(self, url, file_name=None):
+        """Downloads one URL and returns 'downloaded', 'not_modified' or 'failed'."""
+        with stage_timer('download'):
+            status = self._download(url, file_name or url.split('/')[-1])
+        REGISTRY.inc('scrapper_downloads_total', status=status)
+        return status
+
+    def _download(self, url, file_name):
+        pdf_path = os.path.join(self.download_folder, file_name)
+
+        with self._host_limit(url):
+            try:
+                response = self.session.get(url, headers=self._conditional_headers(file_name),
+                                            stream=True, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning("Failed to download %s: %s", file_name, e)
+                return 'failed'
+
+            with response:
+                if response.status_code == 304:
+                    return 'not_modified'
+                if response.status_code != 200:
+                    logger.warning("Failed to download %s: HTTP %s", file_name, response.status_code)
+                    return 'failed'
+
+                fd, tmp_path = tempfile.mkstemp(dir=self.download_folder, prefix=f".{file_name}.", suffix='.part')
+                try:
+                    with os.fdopen(fd, 'wb') as pdf_file:
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            pdf_file.write(chunk)
+                    os.replace(tmp_path, pdf_path)
+                except (OSError, requests.RequestException) as e:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    logger.warning("Failed to download %s: %s", file_name, e)
+                    return 'failed'
+
+        with self._lock:
+            self._meta[file_name] = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            self._save_meta()
+        return 'downloaded'
+
+    def download_all(self, urls, progress=None):
+        """Downloads URLs (or (url, file_name) pairs) in parallel and returns {url: status}.
+
+        `progress(done, total)` is called after each file if given.
+        """
+        jobs = [job if isinstance(job, tuple) else (job, None) for job in urls]
+        statuses = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_url = {executor.submit(self.download, url, file_name): url for url, file_name in jobs}
+            for future in as_completed(future_to_url):
+                statuses[future_to_url[future]] = future.result()
+                if progress:
+                    progress(len(statuses), len(jobs))
+        return {url: statuses[url] for url, _ in jobs}
@@ -0,0 +1,63 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+def configured_workers():
+    """Returns the worker count from EXTRACTION_WORKERS, defaulting to the number of CPUs."""
+    workers = os.environ.get('EXTRACTION_WORKERS')
+    if workers:
+        return max(1, int(workers))
+    return os.cpu_count() or 1
+
+
+def _run_in_worker(extract_fn, pdf_path):
+    # Stage metrics recorded inside the worker process are shipped back with the result
+    REGISTRY.reset()
+    result = extract_fn(pdf_path)
+    return result, REGISTRY.dump()
+
+
+class ExtractionEngine:
+    """Bounded process pool that extracts whole PDF documents in parallel.
+
+    Each worker runs `extract_fn(pdf_path)` on one document at a time, opening
+    its own fitz document, so `extract_fn` must be a module-level function and
+    return plain picklable data.
+    """
+
+    def __init__(self, max_workers=None, mp_context='spawn'):
+        self.max_workers = max(1, max_workers or configured_workers())
+        self.mp_context = mp_context
+
+    def extract_all(self, extract_fn, pdf_paths):
+        """Runs extract_fn on every PDF and returns {pdf_path: result}; failed documents are left out."""
+        pdf_paths = list(pdf_paths)
+        results = {}
+        workers = min(self.max_workers, len(pdf_paths))
+
+        # Not worth starting a pool for a single document or worker
+        if workers <= 1:
+            for pdf_path in pdf_paths:
+                try:
+                    results[pdf_path] = extract_fn(pdf_path)
+                except Exception:
+                    logger.exception("Error processing %s", pdf_path)
+            return results
+
+        context = multiprocessing.get_context(self.mp_context)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            future_to_path = {executor.submit(_run_in_worker, extract_fn, pdf_path): pdf_path for pdf_path in pdf_paths}
+            for future in as_completed(future_to_path):
+                pdf_path = future_to_path[future]
+                try:
+                    results[pdf_path], worker_metrics = future.result()
+                    REGISTRY.merge(worker_metrics)
+                except Exception:
+                    logger.exception("Error processing %s", pdf_path)
+        return results
@@ -0,0 +1,343 @@
+"""Streaming GTFS static feed export of the parsed GABS and MyCiti timetables.
+
+Every source PDF is turned into a feed fragment (its stops, routes, services
+and trips) that is cached on disk next to the extraction cache and validated
+against the PDF, so only fragments of PDFs that changed are rebuilt. The feed
+is then assembled one fragment at a time and streamed into the zip file, so
+memory stays bounded by the largest single timetable.
+
+MyCiti services start on the effective date printed on the timetable. When a
+PDF has none they start on MYCITI_FEED_START instead, and feed_info.txt's
+feed_version says so.
+
+Run from the repository root:
+
+    python gtfs_export.py [gtfs_feed.zip]
+"""
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import zipfile
+
+from cache_service import ExtractionCache
+from metrics import stage_timer
+from pdf_service import PlaceMapService, parse_timetable_file_name
+from timetable_model import DAY_HEADINGS, normalize_place, parse_time, parse_weekdays
+
+logger = logging.getLogger(__name__)
+
+
+# Bump whenever the fragment layout or the way trips are built changes
+FEED_VERSION = 3
+
+FEED_TIMEZONE = 'Africa/Johannesburg'
+AGENCIES = [
+    ('GABS', 'Golden Arrow Bus Services', 'https://www.gabs.co.za'),
+    ('MYCITI', 'MyCiTi', 'https://www.myciti.org.za'),
+]
+# GTFS dates cannot be open-ended; the timetables' 99999999 end date becomes this
+OPEN_END_DATE = '20991231'
+BUS = 3
+# Service start of MyCiti timetables without a printed effective date; a fixed date, so
+# re-downloading a PDF does not move its calendar
+MYCITI_FEED_START = '20250101'
+FEED_PUBLISHER = ('Scrapper', 'https://scrapper-rsro.onrender.com', 'en')
+
+FEED_COLUMNS = {
+    'agency.txt': ['agency_id', 'agency_name', 'agency_url', 'agency_timezone'],
+    'feed_info.txt': ['feed_publisher_name', 'feed_publisher_url', 'feed_lang', 'feed_start_date', 'feed_end_date',
+                      'feed_version'],
+    'stops.txt': ['stop_id', 'stop_name'],
+    'routes.txt': ['route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type'],
+    'calendar.txt': ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday',
+                     'sunday', 'start_date', 'end_date'],
+    'trips.txt': ['route_id', 'service_id', 'trip_id', 'trip_headsign'],
+    'stop_times.txt': ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'],
+}
+
+
+def stop_id(agency, name):
+    return f"{agency}-{re.sub(r'[^A-Z0-9]+', '_', normalize_place(name)).strip('_')}"
+
+
+def format_gtfs_time(minutes):
+    # Trips running past midnight keep counting hours (25:10:00) as GTFS expects
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+class FeedFragment:
+    """The part of the feed built from one source PDF, as plain data so it can be cached."""
+
+    def __init__(self, agency):
+        self.agency = agency
+        self.stops = {}
+        self.routes = {}
+        self.services = {}
+        # key -> {'effective_date': ..., 'trips': [[trip_id, route_id, service_id, headsign, [[stop_id, minutes], ...]]]}
+        self.groups = {}
+
+    def add_service(self, weekdays, start_date, end_date):
+        mask = ''.join('1' if day in weekdays else '0' for day in range(7))
+        service_id = f"{self.agency}-{mask}-{start_date}-{end_date}"
+        self.services[service_id] = [mask, start_date, end_date]
+        return service_id
+
+    def add_trip(self, group, trip_id, route_id, service_id, timed_stops):
+        """Adds a trip from [(stop name, minutes), ...] in stop order; trips need two stops or more."""
+        stop_times = []
+        offset = 0
+        for name, minutes in timed_stops:
+            minutes += offset
+            if stop_times and minutes < stop_times[-1][1]:
+                if stop_times[-1][1] - minutes < 12 * 60:
+                    # A misprint rather than a trip running past midnight: GTFS times cannot go backwards
+                    continue
+                offset += 24 * 60
+                minutes += 24 * 60
+            sid = stop_id(self.agency, name)
+            self.stops[sid] = name
+            stop_times.append([sid, minutes])
+        if len(stop_times) < 2:
+            return
+        headsign = self.stops[stop_times[-1][0]]
+        group['trips'].append([trip_id, route_id, service_id, headsign, stop_times])
+
+    def to_dict(self):
+        return {'agency': self.agency, 'stops': self.stops, 'routes': self.routes,
+                'services': self.services, 'groups': self.groups}
+
+
+def gabs_fragment(pdf_name, extracted_data):
+    """Builds the fragment of a GABS PDF from PlaceMapService.extract_document output.
+
+    Every column of a timetable grid is one trip. Each PDF carries all the
+    direction pages of its timetable family, so trips are grouped by the page's
+    timetable number and day; the exporter keeps each group from one PDF only.
+    """
+    file_info = parse_timetable_file_name(pdf_name) or {}
+    fragment = FeedFragment('GABS')
+    notes = {letter: parse_weekdays(days) for letter, days in extracted_data.get('notes', {}).items()}
+    end_date = file_info.get('end_date')
+    end_date = end_date if end_date and end_date != '99999999' else OPEN_END_DATE
+
+    for table_no, table in enumerate(extracted_data.get('tables', [])):
+        weekdays = DAY_HEADINGS.get(table['day'])
+        time_table_no = table['time_table_no'] or file_info.get('time_table_no', '')
+        if not weekdays or not time_table_no:
+            continue
+        effective_date = (table['effective_date'] or file_info.get('effective_date', '')).replace('/', '')
+        route_id = f"GABS-{time_table_no.replace(' ', '')[:4]}"
+        fragment.routes.setdefault(route_id, [time_table_no[:4], table['title'] or ''])
+        group = fragment.groups.setdefault(f"{time_table_no}|{table['day']}",
+                                           {'effective_date': effective_date, 'trips': []})
+
+        rows = table['rows']
+        for column in range(len(rows[0][1]) if rows else 0):
+            timed_stops = []
+            letter = ''
+            for name, cells in rows:
+                parsed = parse_time(cells[column]) if column < len(cells) else None
+                if parsed:
+                    timed_stops.append((name, parsed[0]))
+                    letter = letter or parsed[1]
+            # A footnote letter narrows the heading's days, e.g. 'b' for Fridays only
+            service_days = set(weekdays) & set(notes.get(letter, weekdays))
+            if not service_days:
+                logger.warning("Skipping trip %d of %s %s: footnote %r names none of its days",
+                               column + 1, time_table_no, table['day'], letter)
+                continue
+            service_id = fragment.add_service(service_days, effective_date, end_date)
+            trip_id = f"GABS-{time_table_no.replace(' ', '')}-{table['day'][:3]}-{table_no}-{column + 1}"
+            fragment.add_trip(group, trip_id, route_id, service_id, timed_stops)
+    return fragment.to_dict()
+
+
+def myciti_fragment(pdf_path, route_data):
+    """Builds the fragment of a MyCiti PDF from TimetableExtractor.parse_timetable_data output.
+
+    The n-th time of every stop in a day section is taken as one trip, so a
+    section is only exported when all of its stops list the same number of times.
+    """
+    fragment = FeedFragment('MYCITI')
+    route = route_data.get('route') or {}
+    code = route.get('code') or os.path.splitext(os.path.basename(pdf_path))[0]
+    route_id = f"MYCITI-{code}"
+    fragment.routes[route_id] = [code, ' '.join((route.get('description') or '').split())]
+    start_date = route.get('effective_date') or MYCITI_FEED_START
+
+    for day, stops in route_data.items():
+        weekdays = DAY_HEADINGS.get(day)
+        if day == 'route' or not weekdays or not stops:
+            continue
+        counts = {len(stop_data['times']) for stop_data in stops}
+        if len(counts) != 1:
+            logger.debug("Skipping %s %s: stops list different numbers of times", code, day)
+            continue
+        group = fragment.groups.setdefault(f"{code}|{day}", {'effective_date': start_date, 'trips': []})
+        service_id = fragment.add_service(weekdays, start_date, OPEN_END_DATE)
+        for column in range(counts.pop()):
+            timed_stops = []
+            for stop_data in stops:
+                parsed = parse_time(stop_data['times'][column])
+                if parsed:
+                    timed_stops.append((stop_data['stop'], parsed[0]))
+            fragment.add_trip(group, f"{route_id}-{day[:3]}-{column + 1}", route_id, service_id, timed_stops)
+    return fragment.to_dict()
+
+
+class GtfsExporter:
+    """Writes the GABS and MyCiti timetables as a GTFS static feed zip.
+
+    The zip's comment holds a digest of the source files it was built from, so
+    ensure_current() only rebuilds it when a source PDF changed.
+    """
+
+    def __init__(self, schedule_service, myciti_extractor=None, output_path='gtfs_feed.zip', cache_folder='gtfs_cache'):
+        self.schedule_service = schedule_service
+        self.myciti_extractor = myciti_extractor
+        self.output_path = output_path
+        self.cache = ExtractionCache(f'gtfs-{FEED_VERSION}-{PlaceMapService.PARSER_VERSION}', cache_folder)
+        self.lock = threading.Lock()
+
+    def sources(self):
+        """Returns [(agency, pdf path), ...] for every PDF the feed is built from."""
+        gabs_folder = self.schedule_service.pdf_service.download_folder
+        sources = [('GABS', os.path.join(gabs_folder, name)) for name in sorted(self.schedule_service.sync.active_files())]
+        extractor = self.myciti_extractor
+        if extractor and os.path.isdir(extractor.download_folder):
+            sources += [('MYCITI', os.path.join(extractor.download_folder, name))
+                        for name in sorted(extractor.list_downloaded_pdfs())]
+        return sources
+
+    def feed_digest(self, sources):
+        signature = [FEED_VERSION, PlaceMapService.PARSER_VERSION]
+        for _, pdf_path in sources:
+            stat = os.stat(pdf_path)
+            signature.append([pdf_path, stat.st_size, stat.st_mtime_ns])
+        return hashlib.sha1(json.dumps(signature).encode('utf-8')).hexdigest()
+
+    def current_digest(self):
+        try:
+            with zipfile.ZipFile(self.output_path) as feed:
+                return feed.comment.decode('ascii')
+        except (OSError, zipfile.BadZipFile, UnicodeDecodeError):
+            return None
+
+    def fragment(self, agency, pdf_path):
+        """Returns the cached fragment of one PDF, building it if the PDF changed."""
+        fragment = self.cache.get(pdf_path)
+        if fragment is not None:
+            return fragment
+        logger.info("Building GTFS fragment for %s", pdf_path)
+        if agency == 'GABS':
+            extracted_data = self.schedule_service.extract_route_data(os.path.basename(pdf_path))
+            fragment = gabs_fragment(os.path.basename(pdf_path), extracted_data)
+        else:
+            from my_citi_pdf_service import extract_myciti_document
+            fragment = myciti_fragment(pdf_path, extract_myciti_document(pdf_path))
+        self.cache.put(pdf_path, fragment)
+        return fragment
+
+    def ensure_current(self):
+        """Returns the feed path, rebuilding the feed first if any source PDF changed."""
+        with self.lock:
+            sources = self.sources()
+            digest = self.feed_digest(sources)
+            if digest != self.current_digest():
+                self.export(sources, digest)
+            return self.output_path
+
+    def export(self, sources=None, digest=None):
+        """Builds every missing fragment and streams the feed into output_path, replacing it atomically."""
+        sources = self.sources() if sources is None else sources
+        digest = self.feed_digest(sources) if digest is None else digest
+
+        with stage_timer('gtfs_export'):
+            # First pass: which PDF each trip group is taken from, and the stops, routes and
+            # services those groups use
+            winners = {}
+            for agency, pdf_path in sources:
+                fragment = self.fragment(agency, pdf_path)
+                for key, group in fragment['groups'].items():
+                    # The newest printing of a timetable page wins; ties keep the first PDF
+                    if key not in winners or group['effective_date'] > winners[key][0]:
+                        trips = group['trips']
+                        winners[key] = (group['effective_date'], pdf_path, {
+                            'stops': {sid: fragment['stops'][sid] for trip in trips for sid, _ in trip[4]},
+                            'routes': {trip[1]: [agency] + fragment['routes'][trip[1]] for trip in trips},
+                            'services': {trip[2]: fragment['services'][trip[2]] for trip in trips},
+                        })
+            stops, routes, services = {}, {}, {}
+            for _, _, used in winners.values():
+                stops.update(used['stops'])
+                routes.update(used['routes'])
+                services.update(used['services'])
+            feed_version = digest[:12]
+            if any(service_id.startswith('MYCITI-') and start_date == MYCITI_FEED_START
+                   for service_id, (_, start_date, _) in services.items()):
+                feed_version += f" (MyCiti timetables without a printed effective date start {MYCITI_FEED_START})"
+
+            folder = os.path.dirname(os.path.abspath(self.output_path))
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+            os.close(fd)
+            try:
+                with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as feed:
+                    feed.comment = digest.encode('ascii')
+                    self._write(feed, 'agency.txt', ([agency_id, name, url, FEED_TIMEZONE]
+                                                     for agency_id, name, url in AGENCIES))
+                    self._write(feed, 'feed_info.txt', [list(FEED_PUBLISHER) + [
+                        min((start_date for _, start_date, _ in services.values()), default=''),
+                        max((end_date for _, _, end_date in services.values()), default=''), feed_version]])
+                    self._write(feed, 'stops.txt', sorted(stops.items()))
+                    self._write(feed, 'routes.txt', ([route_id, agency, short_name, long_name, BUS]
+                                                     for route_id, (agency, short_name, long_name) in sorted(routes.items())))
+                    self._write(feed, 'calendar.txt', ([service_id] + list(mask) + [start_date, end_date]
+                                                       for service_id, (mask, start_date, end_date) in sorted(services.items())))
+                    # Trips and stop times are streamed fragment by fragment, re-read from the cache
+                    self._write(feed, 'trips.txt', ([route_id, service_id, trip_id, headsign]
+                                                    for trip_id, route_id, service_id, headsign, _ in self._trips(sources, winners)))
+                    self._write(feed, 'stop_times.txt', ([trip_id, format_gtfs_time(minutes), format_gtfs_time(minutes), sid, sequence]
+                                                         for trip_id, _, _, _, stop_times in self._trips(sources, winners)
+                                                         for sequence, (sid, minutes) in enumerate(stop_times, 1)))
+                os.replace(tmp_path, self.output_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        logger.info("Wrote GTFS feed %s from %d PDFs", self.output_path, len(sources))
+        return self.output_path
+
+    def _trips(self, sources, winners):
+        for agency, pdf_path in sources:
+            fragment = self.fragment(agency, pdf_path)
+            for key, group in fragment['groups'].items():
+                if winners[key][1] == pdf_path:
+                    yield from group['trips']
+
+    @staticmethod
+    def _write(feed, name, rows):
+        with feed.open(name, 'w') as raw, io.TextIOWrapper(raw, encoding='utf-8', newline='') as text:
+            writer = csv.writer(text, lineterminator='\n')
+            writer.writerow(FEED_COLUMNS[name])
+            writer.writerows(rows)
+
+
+def export_feed(path='gtfs_feed.zip'):
+    """Exports the GTFS feed from the downloaded GABS and MyCiti PDFs."""
+    from my_citi_pdf_service import TimetableExtractor
+    from schedule_service import ScheduleService
+
+    exporter = GtfsExporter(ScheduleService(snapshot_path=None), TimetableExtractor(snapshot_path=None), path)
+    print(f"Wrote {exporter.ensure_current()}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    export_feed(*sys.argv[1:2])
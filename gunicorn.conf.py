@@ -0,0 +1,39 @@
+"""Production settings: gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master (preload_app), which loads the parsed
+timetable index from the memory-mapped snapshot, building and writing the
+snapshot first if it is missing or out of date. Workers are forked afterwards:
+the stop times are views into the shared mapping and the rest of the index is
+shared copy-on-write, so adding workers does not re-parse anything and memory
+stays roughly flat.
+
+Every worker runs a RefreshWorker, but a lock file makes only one of them
+crawl and rebuild; the others reload from the snapshot it writes.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = True
+
+# Read by app.py: threads started in the master would not survive the fork
+os.environ['SCRAPPER_PRELOAD'] = '1'
+
+# Collections in the master would leave holes in the pages the workers share
+gc.disable()
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach, so collections
+    # in the workers never write to (and so un-share) those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+    # One of the workers takes the refresher lock, the others follow its snapshot
+    from app import refresh_worker
+    refresh_worker.start()
@@ -0,0 +1,134 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = 'scrapper_stage_duration_seconds'
+STAGE_ERRORS = 'scrapper_stage_errors_total'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, metric_type, help_text):
+        self._descriptions[name] = (metric_type, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            # Per-bucket (non-cumulative) counts, then sum and count
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 3)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(self.buckets)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def dump(self):
+        """Returns the raw state as plain data, e.g. to ship it back from a worker process."""
+        with self._lock:
+            return {
+                'counters': list(self._counters.items()),
+                'histograms': [(key, list(values)) for key, values in self._histograms.items()],
+            }
+
+    def merge(self, dump):
+        """Adds a dump from another registry (with the same buckets) into this one."""
+        with self._lock:
+            for key, value in dump['counters']:
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, values in dump['histograms']:
+                histogram = self._histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    histogram[i] += value
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def header(name, default_type):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, help_text = self._descriptions.get(name, (default_type, ''))
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+        for (name, label_key), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{_format_labels(label_key)} {value}')
+
+        for (name, label_key), values in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(label_key, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(label_key)} {values[-2]}')
+            lines.append(f'{name}_count{_format_labels(label_key)} {values[-1]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe(STAGE_SECONDS, 'histogram',
+                  'Time spent per pipeline stage (link_fetch, download, page_extraction, parse, index_build, query).')
+REGISTRY.describe(STAGE_ERRORS, 'counter', 'Pipeline stage runs that raised an error.')
+REGISTRY.describe('scrapper_downloads_total', 'counter', 'Timetable downloads by outcome.')
+REGISTRY.describe('scrapper_extraction_cache_total', 'counter', 'Extraction cache lookups by result.')
+REGISTRY.describe('scrapper_response_cache_total', 'counter', 'Cached JSON responses by result (hit, miss, not_modified).')
+
+
+@contextmanager
+def stage_timer(stage):
+    """Times a block into the per-stage latency histogram and counts failures."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        REGISTRY.inc(STAGE_ERRORS, stage=stage)
+        raise
+    finally:
+        REGISTRY.observe(STAGE_SECONDS, time.perf_counter() - start, stage=stage)
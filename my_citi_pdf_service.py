@@ -1,23 +1,33 @@
 import os
-import requests
 from bs4 import BeautifulSoup
 import time
 import PyPDF2
 import re
 import threading
-from concurrent.futures import ThreadPoolExecutor
 import fitz  # PyMuPDF
+import logging
+from extraction_engine import ExtractionEngine
+from download_service import DownloadEngine
+from snapshot_service import TimetableSnapshot
+from metrics import stage_timer
+from timetable_model import DAY_HEADINGS, parse_printed_date
+
+logger = logging.getLogger(__name__)
 
 class MyCitiPDFService:
-    def __init__(self, download_folder='myciti_pdfs'):
-        self.url = 'https://www.myciti.org.za/en/timetables/route-stop-station-timetables/'
+    def __init__(self, download_folder='myciti_pdfs', base_url=None, downloader=None):
+        # MYCITI_BASE_URL points the service at another host, e.g. the stand-in server in benchmarks/
+        self.base_url = (base_url or os.environ.get('MYCITI_BASE_URL', 'https://www.myciti.org.za')).rstrip('/')
+        self.url = f'{self.base_url}/en/timetables/route-stop-station-timetables/'
         self.download_folder = download_folder
         os.makedirs(self.download_folder, exist_ok=True)
+        self.downloader = downloader or DownloadEngine(self.download_folder)
 
     def fetch_route_links(self):
         """Fetches all route links from the website."""
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(self.url, headers=headers)
+        with stage_timer('link_fetch'):
+            response = self.downloader.session.get(self.url, timeout=self.downloader.timeout)
+        response.raise_for_status()
         soup = BeautifulSoup(response.text, 'html.parser')
         routes = soup.find_all('div', class_='route column')
         
@@ -28,71 +38,98 @@ class MyCitiPDFService:
         
         return route_info
 
+    def route_pdf_url(self, route_code):
+        """Returns the timetable PDF URL and file name for a route."""
+        pdf_name = f"{route_code}-timetable.pdf"
+        return f'{self.base_url}/docs/route-timetables/{pdf_name}', pdf_name
+
     def download_route_pdf(self, route_code):
         """Downloads the timetable PDF for a specific route."""
-        pdf_url = f'https://www.myciti.org.za/docs/route-timetables/{route_code}-timetable.pdf'
-        pdf_name = f"{route_code}-timetable.pdf"
-        pdf_path = os.path.join(self.download_folder, pdf_name)
-        
-        response = requests.get(pdf_url, stream=True)
-        if response.status_code == 200:
-            with open(pdf_path, 'wb') as pdf_file:
-                for chunk in response.iter_content(chunk_size=1024):
-                    pdf_file.write(chunk)
-            print(f"Downloaded {pdf_name}")
+        pdf_url, pdf_name = self.route_pdf_url(route_code)
+        status = self.downloader.download(pdf_url, pdf_name)
+        if status == 'downloaded':
+            logger.info("Downloaded %s", pdf_name)
+        elif status == 'not_modified':
+            logger.info("%s is up to date", pdf_name)
         else:
-            print(f"Failed to download {pdf_name}")
+            logger.warning("Failed to download %s", pdf_name)
 
     def download_all_pdfs(self):
-        """Downloads all the timetables for all routes."""
+        """Downloads all the timetables for all routes in parallel, skipping unchanged ones."""
         routes = self.fetch_route_links()
-        for route in routes:
-            print(f"Fetching timetable for route: {route['route_name']} ({route['route_code']})")
-            self.download_route_pdf(route['route_code'])
+        logger.info("Fetching timetables for %d routes", len(routes))
+        return self.downloader.download_all([self.route_pdf_url(route['route_code']) for route in routes])
 
 class TimetableExtractor:
-    def __init__(self, download_folder='myciti_pdfs'):
+    ROUTE_PATTERN = re.compile(r'(\w+):\s([A-Za-z\s\-]+)')
+    DAY_PATTERN = re.compile(r'(MONDAYS TO FRIDAYS|SATURDAYS|SUNDAYS AND PUBLIC HOLIDAYS)')
+    EFFECTIVE_PATTERN = re.compile(r'(?:EFFECTIVE|VALID)(?:\s+(?:FROM|DATE|AS\s+OF))?\s*:?\s*'
+                                   r'(\d{4}[-/]\d{1,2}[-/]\d{1,2}|\d{1,2}/\d{1,2}/\d{4}|\d{1,2}\s+[A-Za-z]+\s+\d{4})',
+                                   re.IGNORECASE)
+    STOP_PATTERN = re.compile(r'([A-Za-z\s\-]+)\s([\d\s:]+)')
+
+    def __init__(self, download_folder='myciti_pdfs', extraction_engine=None, snapshot_path='timetable_snapshot.bin'):
         self.download_folder = download_folder
+        self.extraction_engine = extraction_engine or ExtractionEngine()
+        self.snapshot = TimetableSnapshot(snapshot_path) if snapshot_path else None
         self.routes_data = []
+        self.dataset = None
         self.lock = threading.Lock()
 
     def extract_pdf_data(self, pdf_path):
-        """Extracts text from a PDF using PyMuPDF with parallel processing for faster execution."""
-        with fitz.open(pdf_path) as doc:
-            with ThreadPoolExecutor() as executor:
-                page_texts = list(executor.map(lambda page: page.get_text("blocks"), doc))
+        """Extracts text from a PDF using PyMuPDF, one page after the other."""
+        with stage_timer('page_extraction'), fitz.open(pdf_path) as doc:
+            page_texts = [page.get_text("blocks") for page in doc]
 
         # Flatten and join all extracted text blocks
         text = "\n".join(["\n".join(block[4] for block in page if len(block) > 4) for page in page_texts])
         return text
 
+    def iter_timetable_sections(self, pdf_text):
+        """Yields (section, stop_name, times) rows in one forward pass over the text.
+
+        The section is 'route' for the header before the first day heading and
+        the day heading afterwards. Each section is matched in place between
+        its own heading and the next one, so no text is copied or re-scanned.
+        """
+        section = 'route'
+        section_start = 0
+        day_matches = self.DAY_PATTERN.finditer(pdf_text)
+        while True:
+            day_match = next(day_matches, None)
+            section_end = day_match.start() if day_match else len(pdf_text)
+            for stop_match in self.STOP_PATTERN.finditer(pdf_text, section_start, section_end):
+                yield section, stop_match.group(1).strip(), stop_match.group(2).split()
+            if not day_match:
+                return
+            section = day_match.group(1)
+            section_start = day_match.end()
+
     def parse_timetable_data(self, pdf_text):
         """Parses timetable data from the extracted PDF text."""
         timetable_data = {}
-        route_pattern = re.compile(r'(\w+):\s([A-Za-z\s\-]+)')
-        day_pattern = re.compile(r'(MONDAYS TO FRIDAYS|SATURDAYS|SUNDAYS AND PUBLIC HOLIDAYS)')
-        stop_pattern = re.compile(r'([A-Za-z\s\-]+)\s([\d\s:]+)')
 
         # Route and description
-        route_match = route_pattern.search(pdf_text)
+        route_match = self.ROUTE_PATTERN.search(pdf_text)
         if route_match:
             timetable_data['route'] = {
                 'code': route_match.group(1),
                 'description': route_match.group(2)
             }
 
-        # Days and stops
-        for day_match in day_pattern.finditer(pdf_text):
-            day = day_match.group(1)
-            timetable_data[day] = []
-            day_text_start = pdf_text[day_match.end():]
-            for stop_match in stop_pattern.finditer(day_text_start):
-                stop_name = stop_match.group(1).strip()
-                times = stop_match.group(2).strip().split()
-                timetable_data[day].append({'stop': stop_name, 'times': times})
+        # The date the timetable is in force from, when it is printed ('YYYYMMDD')
+        effective_match = self.EFFECTIVE_PATTERN.search(pdf_text)
+        effective_date = parse_printed_date(effective_match.group(1)) if effective_match else None
+        if effective_date:
+            timetable_data.setdefault('route', {})['effective_date'] = effective_date
+
+        # Days and stops; a day heading repeated on later pages adds to the same day
+        for section, stop_name, times in self.iter_timetable_sections(pdf_text):
+            if section != 'route':
+                timetable_data.setdefault(section, []).append({'stop': stop_name, 'times': times})
 
         return timetable_data
-    
+
     def display_timetable(self, route_code):
         """Extracts, parses, and displays timetable data for the given route."""
         pdf_name = f"{route_code}-timetable.pdf"
@@ -120,14 +157,23 @@ class TimetableExtractor:
 
     def list_downloaded_pdfs(self):
         """Lists all downloaded PDF files."""
-        return [f for f in os.listdir(self.download_folder) if os.path.isfile(os.path.join(self.download_folder, f))]
+        return [f for f in os.listdir(self.download_folder)
+                if not f.startswith('.') and os.path.isfile(os.path.join(self.download_folder, f))]
     
     def getAllRoutes(self):
         """Returns a list of all downloaded PDF files."""
         return self.list_downloaded_pdfs()
+
+    def pdfs_signature(self):
+        """Returns a cheap (name, size, mtime) fingerprint of the downloaded PDFs."""
+        signature = []
+        for pdf_name in self.list_downloaded_pdfs():
+            stat = os.stat(os.path.join(self.download_folder, pdf_name))
+            signature.append((pdf_name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(signature))
     
     def threadingInRoutes(self, start, end, all_route_paths, threadNum):
-        print(f"Thread {threadNum} started")
+        logger.debug("Thread %s started", threadNum)
         start_time = time.time()  # Start timer
         routes_data_found = []
         for routeIndex in range(start, end):
@@ -137,84 +183,104 @@ class TimetableExtractor:
             routes_data_found.append(timetable_data)
         end_time = time.time()  # End timer
         execution_time = end_time - start_time
-        print(f"Thread {threadNum} finished with {len(routes_data_found)} routes data found. Took {execution_time}s")
+        logger.debug("Thread %s finished with %d routes data found. Took %.2fs", threadNum, len(routes_data_found), execution_time)
         # Locking ensures only one thread can update results at a time
         with self.lock:
             self.routes_data.extend(routes_data_found)
 
-    def getAllRoutesData(self):
-        """Extracts and returns structured timetable data for all routes using ThreadPoolExecutor."""
-        self.routes_data = []
-        all_route_paths = self.getAllRoutes()
-        
-        print(f"Processing {len(all_route_paths)} routes...")
-        
-        num_threads = max(1, len(all_route_paths) // 4)  # Ensure at least 1 thread
-        start_time = time.time()
+    def loadAllRoutesData(self, signature=None):
+        """Extracts structured timetable data for all routes using the extraction engine (or the snapshot)."""
+        if self.snapshot:
+            snapshot_data = self.snapshot.myciti_routes(signature if signature is not None else self.pdfs_signature())
+            if snapshot_data is not None:
+                return snapshot_data
 
-        def process_route(pdf_path):
-            pdf_text = self.extract_pdf_data(pdf_path)
-            return self.parse_timetable_data(pdf_text)
+        all_route_paths = [os.path.join(self.download_folder, route) for route in self.getAllRoutes()]
 
-        with ThreadPoolExecutor(max_workers=num_threads) as executor:
-            results = executor.map(process_route, [os.path.join(self.download_folder, route) for route in all_route_paths])
+        logger.info("Processing %d routes...", len(all_route_paths))
+        start_time = time.time()
 
-        self.routes_data = list(results)
-        
-        execution_time = time.time() - start_time
-        print(f"Processed all routes in {execution_time:.2f} seconds with {num_threads} threads.")
+        results = self.extraction_engine.extract_all(extract_myciti_document, all_route_paths)
+        routes_data = [results[pdf_path] for pdf_path in all_route_paths if pdf_path in results]
 
-        return self.routes_data
+        execution_time = time.time() - start_time
+        logger.info("Processed all routes in %.2f seconds with %d workers.", execution_time, self.extraction_engine.max_workers)
 
+        return routes_data
 
-    
-        
-    def getAllStops(self):
-        """Returns all stops from all route timetables using parallel processing."""
-        all_routes_data = self.getAllRoutesData()  # Fetch all routes data efficiently
+    def getDataset(self):
+        """Returns the loaded MyCiti dataset, reloading it only when the set of PDFs changes."""
+        signature = self.pdfs_signature()
+        with self.lock:
+            if self.dataset is None or self.dataset.signature != signature:
+                routes_data = self.loadAllRoutesData(signature)
+                with stage_timer('index_build'):
+                    self.dataset = MyCitiDataset(signature, routes_data)
+                self.routes_data = self.dataset.routes_data
+            return self.dataset
 
+    def getAllRoutesData(self):
+        """Returns structured timetable data for all routes, loaded once per set of PDFs."""
+        return self.getDataset().routes_data
 
-        def extract_stops(route):
-            stops = [] # Using a set to avoid duplicate stops
-            for day, stops_list in route.items():
-                if day == 'route':
-                    continue
-                for stop_data in stops_list:
-                    stops.append(stop_data)
-            return stops
+    def getAllStops(self):
+        """Returns all stops from all route timetables."""
+        return list(self.getDataset().all_stops)
 
-        with ThreadPoolExecutor() as executor:
-            results = executor.map(extract_stops, all_routes_data)
+    def hasStop(self, stop_to_search):
+        """Checks if a stop exists in the timetable data."""
+        return stop_to_search.lower() in self.getDataset().stop_routes
 
-        # Flatten the results into a list
-        all_stops = [stop for stops in results for stop in stops]
+    def findRoutesFor(self, stop, dest, weekday=None):
+        """Finds routes that include both the stop and destination on weekdays or Saturdays, or on weekday (Monday = 0)."""
+        with stage_timer('query'):
+            return self._findRoutesFor(stop, dest, weekday)
 
-        return all_stops
+    def _findRoutesFor(self, stop, dest, weekday=None):
+        dataset = self.getDataset()
+        stop_days = dataset.stop_days.get(stop.lower(), {})
+        dest_days = dataset.stop_days.get(dest.lower(), {})
 
-    def hasStop(self, stop_to_search):
-        """Checks if a stop exists in the timetable data."""
-        all_stops = self.getAllStops()
-        return any(stop_to_search.lower() == stop['stop'].lower() for stop in all_stops)
+        if weekday is None:
+            days = ['MONDAYS TO FRIDAYS', 'SATURDAYS']
+        else:
+            days = [day for day, weekdays in DAY_HEADINGS.items() if weekday in weekdays]
+        route_ids = set()
+        for day in days:
+            route_ids.update(stop_days.get(day, set()) & dest_days.get(day, set()))
 
-    def findRoutesFor(self, stop, dest):
-        """Finds routes that include both the stop and destination using parallel processing."""
-        all_routes_data = self.getAllRoutesData()  # Ensure data is fetched correctly
+        return [dataset.routes_data[route_id] for route_id in sorted(route_ids)]
 
-        stop_lower = stop.lower()
-        dest_lower = dest.lower()
 
-        def route_matches(route):
-            for day in ['MONDAYS TO FRIDAYS', 'SATURDAYS']:
-                if day in route:
-                    stops_set = {stop_data['stop'].lower() for stop_data in route[day]}  # Convert list to set
-                    if stop_lower in stops_set and dest_lower in stops_set:
-                        return route
-            return None
+class MyCitiDataset:
+    """Parsed MyCiti routes with stop indexes, built once per set of PDFs."""
 
-        with ThreadPoolExecutor() as executor:
-            results = executor.map(route_matches, all_routes_data)
+    def __init__(self, signature, routes_data):
+        self.signature = signature
+        self.routes_data = routes_data
+        self.all_stops = []
+        # lowercased stop name -> ids of the routes serving it
+        self.stop_routes = {}
+        # lowercased stop name -> day type -> ids of the routes serving it that day
+        self.stop_days = {}
 
-        return [route for route in results if route is not None]
+        for route_id, route in enumerate(routes_data):
+            for day, stops_list in route.items():
+                if day == 'route':
+                    continue
+                for stop_data in stops_list:
+                    self.all_stops.append(stop_data)
+                    stop_key = stop_data['stop'].lower()
+                    self.stop_routes.setdefault(stop_key, set()).add(route_id)
+                    self.stop_days.setdefault(stop_key, {}).setdefault(day, set()).add(route_id)
+
+
+def extract_myciti_document(pdf_path):
+    """Extracts and parses one MyCiti timetable PDF; module level so extraction workers can run it."""
+    extractor = TimetableExtractor(download_folder=os.path.dirname(pdf_path), snapshot_path=None)
+    pdf_text = extractor.extract_pdf_data(pdf_path)
+    with stage_timer('parse'):
+        return extractor.parse_timetable_data(pdf_text)
 
 
 # Example usage:
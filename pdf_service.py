@@ -1,27 +1,67 @@
+import bisect
+import logging
 import os
 import re
-import requests
-from bs4 import BeautifulSoup
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+from bs4 import BeautifulSoup, SoupStrainer
 import PyPDF2
 import fitz  # PyMuPDF
-import threading
+from download_service import DownloadEngine
+from metrics import stage_timer
+from timetable_model import parse_time
+
+
+logger = logging.getLogger(__name__)
+
+
+TIMETABLE_FILE_PATTERN = re.compile(r"([^_]+(?:_[^_]+)*)___([^_]+(?:_[^_]+)*)_from_(\d+)_to_(\d+)_([\d]+)\.pdf")
+
+
+# Function to split a GABS timetable file name into its route, effective dates and timetable number
+def parse_timetable_file_name(file_name):
+    match = TIMETABLE_FILE_PATTERN.match(file_name)
+    if not match:
+        return None
+    return {
+        'from_route': match.group(1).replace('_', ' ').title(),
+        'to_route': match.group(2).replace('_', ' ').title(),
+        'effective_date': match.group(3),
+        'end_date': match.group(4),
+        'time_table_no': match.group(5),
+    }
 
 
 class PDFService:
-    def __init__(self, download_folder='pdf_downloads'):
-        self.url = 'https://www.gabs.co.za/Timetable.aspx'
-        self.file_url = 'https://www.gabs.co.za'
+    # Only the download buttons are built into a tree; the rest of the page is skipped
+    DOWNLOAD_BUTTONS = SoupStrainer('button', attrs={'title': 'Download', 'onclick': True})
+    LINK_PATTERN = re.compile(r"window\.open\(['\"](.*?)['\"]")
+
+    def __init__(self, download_folder='pdf_downloads', link_ttl=None, base_url=None, downloader=None):
+        # GABS_BASE_URL points the service at another host, e.g. the stand-in server in benchmarks/
+        self.file_url = (base_url or os.environ.get('GABS_BASE_URL', 'https://www.gabs.co.za')).rstrip('/')
+        self.url = f'{self.file_url}/Timetable.aspx'
         self.download_folder = download_folder
         os.makedirs(self.download_folder, exist_ok=True)
+        self.downloader = downloader or DownloadEngine(self.download_folder)
 
-    def fetch_pdf_links(self):
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(self.url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        buttons = soup.find_all('button', {'title': 'Download'}, onclick=True)
+        # Cached link listing: served from memory for link_ttl seconds (LINKS_TTL), then served
+        # stale while a single background request revalidates it
+        self.link_ttl = link_ttl if link_ttl is not None else float(os.environ.get('LINKS_TTL', 300))
+        self._links = None
+        self._links_fetched_at = 0.0
+        self._links_validators = {}
+        self._links_lock = threading.Lock()
+        self._links_first_fetch = threading.Lock()
+        self._links_revalidating = False
+
+    def parse_pdf_links(self, html):
+        soup = BeautifulSoup(html, 'html.parser', parse_only=self.DOWNLOAD_BUTTONS)
         pdf_urls = []
-        for button in buttons:
-            pdf_match = re.search(r"window\.open\(['\"](.*?)['\"]", button['onclick'])
+        for button in soup.find_all('button'):
+            pdf_match = self.LINK_PATTERN.search(button['onclick'])
             if pdf_match:
                 pdf_url = pdf_match.group(1)
                 if not pdf_url.startswith('http'):
@@ -29,69 +69,255 @@ class PDFService:
                 pdf_urls.append(pdf_url)
         return pdf_urls
 
+    def fetch_pdf_links(self):
+        """Fetches the timetable links from the site, as a conditional request once they are cached."""
+        with self._links_lock:
+            headers = dict(self._links_validators) if self._links is not None else {}
+        with stage_timer('link_fetch'):
+            response = self.downloader.session.get(self.url, headers=headers, timeout=self.downloader.timeout)
+
+        if response.status_code == 304 and self._links is not None:
+            pdf_urls = self._links
+        else:
+            response.raise_for_status()
+            pdf_urls = self.parse_pdf_links(response.text)
+            validators = {}
+            if response.headers.get('ETag'):
+                validators['If-None-Match'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                validators['If-Modified-Since'] = response.headers['Last-Modified']
+            with self._links_lock:
+                self._links_validators = validators
+
+        with self._links_lock:
+            self._links = pdf_urls
+            self._links_fetched_at = time.monotonic()
+        return pdf_urls
+
+    def cached_pdf_links(self):
+        """Returns the link listing from memory, fetching it only the first time.
+
+        Once the listing is older than link_ttl it is still returned as is, and
+        one background request revalidates it.
+        """
+        pdf_urls = self._links
+        if pdf_urls is None:
+            with self._links_first_fetch:
+                return self._links if self._links is not None else self.fetch_pdf_links()
+        if time.monotonic() - self._links_fetched_at >= self.link_ttl:
+            self._start_links_revalidation()
+        return pdf_urls
+
+    def _start_links_revalidation(self):
+        with self._links_lock:
+            if self._links_revalidating:
+                return
+            self._links_revalidating = True
+        threading.Thread(target=self._revalidate_links, name='link-revalidate', daemon=True).start()
+
+    def _revalidate_links(self):
+        try:
+            self.fetch_pdf_links()
+        except Exception:
+            logger.exception("Revalidating the timetable links failed; serving the cached listing")
+            with self._links_lock:
+                # Retry after another interval rather than on every request
+                self._links_fetched_at = time.monotonic()
+        finally:
+            with self._links_lock:
+                self._links_revalidating = False
+
     def download_pdfs(self):
         pdf_urls = self.fetch_pdf_links()
-        for pdf_url in pdf_urls:
-            pdf_name = pdf_url.split('/')[-1]
-            pdf_path = os.path.join(self.download_folder, pdf_name)
-            response = requests.get(pdf_url, stream=True)
-            if response.status_code == 200:
-                with open(pdf_path, 'wb') as pdf_file:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        pdf_file.write(chunk)
+        # Unchanged files are answered with a 304 and left as they are on disk
+        self.downloader.download_all(pdf_urls)
         return pdf_urls
 
     def list_downloaded_pdfs(self):
-        return [f for f in os.listdir(self.download_folder) if os.path.isfile(os.path.join(self.download_folder, f))]
+        # Dotfiles are the downloader's metadata and in-flight temp files
+        return [f for f in os.listdir(self.download_folder)
+                if not f.startswith('.') and os.path.isfile(os.path.join(self.download_folder, f))]
+
+    def downloaded_pdfs_signature(self):
+        """Returns a cheap (name, size, mtime) fingerprint of the downloaded files."""
+        signature = []
+        for entry in os.scandir(self.download_folder):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(signature))
 
 class PlaceMapService:
-    def __init__(self):
+    # Bump whenever the extraction output changes so cached results are rebuilt
+    PARSER_VERSION = 4
+
+    DAY_PATTERN = re.compile(r'^(MONDAYS TO FRIDAYS|SATURDAYS|SUNDAYS)\b(\s*-\s*NO SERVICE)?')
+    HEADER_PATTERN = re.compile(r'EFFECTIVE DATE:\s*(\S+)\s+TIMETABLE NUMBER:\s*(.*\S)')
+    # Footnotes under ABBREVIATIONS, e.g. 'a  - Mondays,Tuesdays,Wednesdays,Thursdays'
+    NOTE_PATTERN = re.compile(r'^([a-z])\s+-\s+((?:Mon|Tues|Wednes|Thurs|Fri|Satur|Sun)days?\b.*)$')
+    # Every grid row is '| PLACE |t1|...|t22|'
+    TIME_COLUMNS = 22
+
+    def __init__(self, download_folder='pdf_downloads'):
+        self.download_folder = download_folder
+        # Places map of the last extracted document only, so memory is bounded by one PDF
         self.places_map = []
-        self.lock = threading.Lock()
-
-    def add_place(self, place):
-        with self.lock:
-            existing_place = next((p for p in self.places_map if p['name'] == place['name']), None)
-            if existing_place:
-                existing_place['times'] = list(set(existing_place['times'] + place['times']))
-            else:
-                self.places_map.append(place)
-
-    def process_text_chunk(self, text, places_found):
-        rows = text.split('\n')
-        for row in rows:
-            inbetweens = row.split('|')
-            for i, value in enumerate(inbetweens):
-                value = value.strip()
-                if self.is_place(value):
-                    place = {
-                        'name': value,
-                        'times': inbetweens[i + 1:i + 23],
-                        'next': inbetweens[i + 24] if i + 24 < len(inbetweens) else None,
-                        'prev': inbetweens[i - 24] if i - 24 >= 0 else None
-                    }
-                    self.add_place(place)
-                    with self.lock:
-                        if value not in places_found:
-                            places_found.append(value)
 
-    def extract_text_from_pdf(self, pdf_path):
-        places_found = []
-        pdf_path = os.path.join('pdf_downloads', pdf_path)
-        
+    def add_place(self, place, places):
+        # places is keyed by name and each entry's times is a dict used as an ordered set
+        existing_place = places.get(place['name'])
+        if existing_place:
+            existing_place['times'].update(dict.fromkeys(place['times']))
+        else:
+            place['times'] = dict.fromkeys(place['times'])
+            places[place['name']] = place
+
+    # Function to split a words entry into its '|'-separated pieces with their horizontal centre.
+    # The timetables are set in a monospaced font, so every character is the same width.
+    def split_word(self, word):
+        x0, _, x1, _, text = word[:5]
+        if '|' not in text or text == '|':
+            return [((x0 + x1) / 2, text)]
+        char_width = (x1 - x0) / len(text)
+        pieces = []
+        start = 0
+        while True:
+            end = text.find('|', start)
+            if end < 0:
+                end = len(text)
+            if end > start:
+                pieces.append((x0 + (start + end) * char_width / 2, text[start:end]))
+            if end == len(text):
+                return pieces
+            pieces.append((x0 + (end + 0.5) * char_width, '|'))
+            start = end + 1
+
+    # Function to read the lines of one grid region into bands of rows. Each line is [(x, piece), ...]
+    # from left to right; every piece goes into the column whose separators it lies between.
+    # Returns [(rows, headings), ...] where headings are the lines printed above that band.
+    def read_grid(self, lines):
+        # The separators of the fullest row are the column rulers for the whole region
+        rulers = max(([x for x, piece in line if piece == '|'] for line in lines), key=len, default=[])
+        if len(rulers) < 2:
+            return []
+
+        bands, rows, headings = [], [], []
+        for line in lines:
+            text = ''.join(piece for _, piece in line)
+            if line[0][1] != '|' or set(text) <= set('|-'):
+                # A rule or a heading (e.g. SATURDAYS below the weekday grid) ends the current band
+                if rows:
+                    bands.append((rows, headings))
+                    rows, headings = [], []
+                if text.strip('|-'):
+                    headings.append(' '.join(piece for _, piece in line))
+                continue
+
+            cells = [[] for _ in range(len(rulers) - 1)]
+            for x, piece in line:
+                column = bisect.bisect(rulers, x) - 1
+                if piece != '|' and 0 <= column < len(cells):
+                    cells[column].append(piece)
+            name = ' '.join(cells[0])
+            if name:
+                rows.append([name, [' '.join(cell) for cell in cells[1:self.TIME_COLUMNS + 1]]])
+        if rows or headings:
+            bands.append((rows, headings))
+        return bands
+
+    # Function to find the timetable grids of a page from one text layout pass and read only their
+    # regions. section carries the day and timetable header across pages, as a grid can continue on the next one.
+    def extract_page_tables(self, page, section):
+        textpage = page.get_textpage()
+        blocks = textpage.extractBLOCKS()
+        grid_blocks = {block[5] for block in blocks
+                       if block[6] == 0 and any(line.startswith('|') and line.strip('|-')
+                                                for line in block[4].split('\n'))}
+
+        # words carry their block and line numbers; only the words of grid blocks are split into cells
+        grid_lines = {block_no: [] for block_no in grid_blocks}
+        for (block_no, _), line_words in groupby(textpage.extractWORDS(), key=itemgetter(5, 6)):
+            if block_no in grid_lines:
+                grid_lines[block_no].append([piece for word in line_words for piece in self.split_word(word)])
+
+        tables = []
+        title = None
+        for _, _, _, _, text, block_no, block_type in blocks:
+            if block_type != 0:
+                continue
+            lines = [line.strip() for line in text.split('\n') if line.strip()]
+            if title is None and lines:
+                title = ' '.join(lines[0].split())
+            if block_no not in grid_lines:
+                for line in lines:
+                    self.read_heading(line, section)
+                continue
+
+            for rows, headings in self.read_grid(grid_lines[block_no]):
+                for heading in headings:
+                    self.read_heading(heading, section)
+                if rows:
+                    tables.append({
+                        'page': page.number,
+                        'title': title,
+                        'day': section['day'],
+                        'effective_date': section['effective_date'],
+                        'time_table_no': section['time_table_no'],
+                        'rows': rows,
+                    })
+        return tables
+
+    # Function to pick the service day, the timetable header and footnotes out of a heading line
+    def read_heading(self, line, section):
+        note_match = self.NOTE_PATTERN.match(line)
+        if note_match:
+            section['notes'][note_match.group(1)] = ' '.join(note_match.group(2).split())
+            return
+        day_match = self.DAY_PATTERN.match(line)
+        if day_match:
+            section['day'] = None if day_match.group(2) else day_match.group(1)
+        header_match = self.HEADER_PATTERN.search(line)
+        if header_match:
+            section['effective_date'] = header_match.group(1)
+            section['time_table_no'] = ' '.join(header_match.group(2).split())
+
+    def extract_document(self, pdf_path):
+        """Extracts one PDF into {'places', 'placesMap', 'tables', 'notes'} built only from that document.
+
+        notes maps the footnote letters printed next to times to the days they name.
+        """
+        tables = []
+        pdf_path = os.path.join(self.download_folder, pdf_path)
+        section = {'day': None, 'effective_date': None, 'time_table_no': None, 'notes': {}}
+
+        # Pages are processed in order; parallelism happens across documents in ExtractionEngine
         with fitz.open(pdf_path) as doc:
-            threads = []
             for page in doc:
-                text = page.get_text("text") + '\n'
-                thread = threading.Thread(target=self.process_text_chunk, args=(text, places_found))
-                thread.start()
-                threads.append(thread)
-            
-            for thread in threads:
-                thread.join()
-        
-        return places_found
-
-    def is_place(self, text):
-        return not (':' in text or 'via' in text or '-' in text or text.strip() == '')
+                with stage_timer('page_extraction'):
+                    tables.extend(self.extract_page_tables(page, section))
+
+        with stage_timer('parse'):
+            places = {}
+            for table in tables:
+                rows = table['rows']
+                for i, (name, cells) in enumerate(rows):
+                    self.add_place({
+                        'name': name,
+                        'times': [cell for cell in cells if parse_time(cell)],
+                        'next': rows[i + 1][0] if i + 1 < len(rows) else None,
+                        'prev': rows[i - 1][0] if i > 0 else None,
+                    }, places)
+
+        places_map = [dict(place, times=list(place['times'])) for place in places.values()]
+        return {'places': list(places), 'placesMap': places_map, 'tables': tables, 'notes': section['notes']}
+
+    def extract_text_from_pdf(self, pdf_path):
+        extracted_data = self.extract_document(pdf_path)
+        self.places_map = extracted_data['placesMap']
+        return extracted_data['places']
+
 
+# Extracts one GABS timetable PDF; module level so ExtractionEngine workers can run it
+def extract_gabs_document(pdf_path):
+    place_service = PlaceMapService(download_folder=os.path.dirname(pdf_path))
+    return place_service.extract_document(os.path.basename(pdf_path))
@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks (Windows): every process refreshes on its own, as a single process would
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshJob:
+    """State and progress of one timetable refresh."""
+
+    FIELDS = ('id', 'trigger', 'state', 'stage', 'done', 'total', 'created_at', 'started_at', 'finished_at',
+              'error', 'report')
+
+    def __init__(self, trigger='manual'):
+        self.id = uuid.uuid4().hex[:12]
+        self.trigger = trigger
+        self.state = 'queued'
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.report = None
+        self.store = None
+
+    def update(self, stage, done=0, total=None):
+        self.stage, self.done, self.total = stage, done, total
+        if self.store:
+            self.store.save(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'trigger': self.trigger,
+            'state': self.state,
+            'stage': self.stage,
+            'progress': {'done': self.done, 'total': self.total},
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'report': self.report,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['trigger'])
+        for field in cls.FIELDS:
+            if field in data:
+                setattr(job, field, data[field])
+        job.done, job.total = data['progress']['done'], data['progress']['total']
+        return job
+
+
+class RefreshJobStore:
+    """Refresh jobs as JSON files in a folder, so every process can queue and report on them."""
+
+    LOCK_FILE = '.lock'
+
+    def __init__(self, folder, max_jobs=20):
+        self.folder = folder
+        self.max_jobs = max_jobs
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, f'{job_id}.json')
+
+    @contextmanager
+    def locked(self):
+        """Holds the store's lock across processes, e.g. to find or add a queued job."""
+        with open(os.path.join(self.folder, self.LOCK_FILE), 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def save(self, job):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as job_file:
+            json.dump(job.to_dict(), job_file)
+        os.replace(tmp_path, self._path(job.id))
+
+    def load(self, job_id):
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as job_file:
+                return RefreshJob.from_dict(json.load(job_file))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def jobs(self):
+        """Returns every stored job, oldest first."""
+        jobs = [self.load(name[:-5]) for name in os.listdir(self.folder)
+                if name.endswith('.json') and not name.startswith('.')]
+        return sorted((job for job in jobs if job), key=lambda job: job.created_at)
+
+    def prune(self):
+        jobs = self.jobs()
+        for job in jobs[:max(0, len(jobs) - self.max_jobs)]:
+            if job.state != 'queued':
+                try:
+                    os.remove(self._path(job.id))
+                except OSError:
+                    pass
+
+
+class RefreshWorker:
+    """Refreshes the GABS timetables in a background thread.
+
+    Each refresh fetches the links, downloads what changed, re-extracts, builds
+    a new immutable RouteIndex and only then swaps it into the ScheduleService,
+    so requests keep answering from the previous index and never wait on it.
+    Runs every `interval` seconds (REFRESH_INTERVAL, 0 disables) and on demand
+    through trigger().
+
+    Several processes (the gunicorn workers) may each run one. A lock file next
+    to the PDFs makes exactly one of them the refresher; the others only reload
+    their index once the refresher has published a new one, checking every
+    `poll_interval` seconds (REFRESH_POLL_INTERVAL). Jobs are kept in a
+    RefreshJobStore, so any process can queue one and report on it.
+    """
+
+    LOCK_FILE = '.refresh.lock'
+    JOBS_FOLDER = '.refresh_jobs'
+
+    def __init__(self, schedule_service, interval=None, max_jobs=20, poll_interval=None):
+        self.schedule_service = schedule_service
+        self.interval = interval if interval is not None else float(os.environ.get('REFRESH_INTERVAL', 6 * 3600))
+        self.poll_interval = (poll_interval if poll_interval is not None
+                              else float(os.environ.get('REFRESH_POLL_INTERVAL', 2)))
+        download_folder = schedule_service.pdf_service.download_folder
+        self.lock_path = os.path.join(download_folder, self.LOCK_FILE)
+        self.jobs = RefreshJobStore(os.path.join(download_folder, self.JOBS_FOLDER), max_jobs)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock_file = None
+        self._started_at = time.time()
+
+    def start(self):
+        """Starts the worker thread and hands index freshness over to it."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self.schedule_service.background_refresh = True
+            self._thread = threading.Thread(target=self._run, name='timetable-refresh', daemon=True)
+            self._thread.start()
+
+    def trigger(self, trigger='manual'):
+        """Queues a refresh and returns its job; an already queued refresh is reused."""
+        with self.jobs.locked():
+            job = next((job for job in self.jobs.jobs() if job.state == 'queued'), None)
+            if job is None:
+                job = RefreshJob(trigger)
+                self.jobs.save(job)
+        self._wake.set()
+        self.start()
+        return job
+
+    def get_job(self, job_id):
+        return self.jobs.load(job_id)
+
+    def is_refresher(self):
+        """Takes the refresher lock if no other process holds it; held until this process exits."""
+        if self._lock_file is not None or fcntl is None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info("Process %d is the timetable refresher", os.getpid())
+        # Jobs still running belonged to a refresher that exited before finishing them
+        with self.jobs.locked():
+            for job in self.jobs.jobs():
+                if job.state == 'running':
+                    job.state, job.error, job.finished_at = 'failed', 'Refresher exited', time.time()
+                    self.jobs.save(job)
+        return True
+
+    def _next_job(self):
+        with self.jobs.locked():
+            jobs = self.jobs.jobs()
+            job = next((job for job in jobs if job.state == 'queued'), None)
+            if job is None and self.interval > 0:
+                # Scheduled from the last refresh by any process, so a new refresher does not crawl again early
+                last_run = max((job.finished_at or job.created_at for job in jobs), default=self._started_at)
+                if time.time() >= last_run + self.interval:
+                    job = RefreshJob('scheduled')
+            if job is not None:
+                job.state = 'running'
+                job.started_at = time.time()
+                self.jobs.save(job)
+            return job
+
+    def _run(self):
+        # Load whatever is on disk first so the first requests do not pay for it
+        try:
+            self.schedule_service.get_route_index()
+        except Exception:
+            logger.exception("Initial route index load failed")
+
+        while True:
+            try:
+                if self.is_refresher():
+                    job = self._next_job()
+                    while job:
+                        self.refresh(job)
+                        job = self._next_job()
+                    self.jobs.prune()
+                else:
+                    self.schedule_service.follow_route_index()
+            except Exception:
+                logger.exception("Refresh loop failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def refresh(self, job):
+        """Runs one refresh to completion in the calling thread."""
+        job.store = self.jobs
+        job.state = 'running'
+        job.started_at = job.started_at or time.time()
+        schedule_service = self.schedule_service
+        try:
+            sync_report = schedule_service.sync.sync(progress=job.update)
+
+            job.update('extract')
+            files_signature = schedule_service.sync.signature()
+            route_index = schedule_service.rebuild_route_index(files_signature)
+
+            job.report = {
+                'routes': len(route_index.routes),
+                'places': len(route_index.place_routes),
+                **{key: len(sync_report[key]) for key in
+                   ('published', 'active', 'superseded', 'withdrawn', 'downloaded', 'not_modified', 'failed')},
+            }
+            job.state = 'succeeded'
+            logger.info("Refresh %s finished: %s", job.id, job.report)
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
+            logger.exception("Refresh %s failed", job.id)
+        finally:
+            job.stage = None
+            job.finished_at = time.time()
+            self.jobs.save(job)
+        return job
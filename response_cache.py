@@ -0,0 +1,126 @@
+"""Serialized, pre-compressed JSON response bodies with ETag revalidation.
+
+orjson and brotli are used when installed (pip install orjson brotli); the
+json module and gzip are the fallbacks.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+from metrics import REGISTRY
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 512
+
+
+def dumps(data):
+    """Serializes data to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class CachedResponse:
+    """One JSON body in every encoding it is served in, serialized and compressed once."""
+
+    __slots__ = ('etag', 'status', 'bodies')
+
+    def __init__(self, etag, data, status=200):
+        self.etag = etag
+        self.status = status
+        body = dumps(data)
+        self.bodies = {'identity': body}
+        if len(body) >= COMPRESS_MIN_BYTES:
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body, quality=5)
+            self.bodies['gzip'] = gzip.compress(body, compresslevel=6, mtime=0)
+
+
+class ResponseCache:
+    """LRU of CachedResponses keyed by the version of the data they were built from.
+
+    The ETag is derived from that version and the request key alone, so a
+    repeat request is answered with a 304 before anything is built, and a new
+    client gets the stored compressed body. Entries of older versions are
+    simply never asked for again and age out.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries if max_entries is not None else int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag_for(version, key):
+        return hashlib.sha1(repr((version, key)).encode('utf-8')).hexdigest()
+
+    def get(self, etag, build):
+        with self._lock:
+            cached = self._entries.get(etag)
+            if cached is not None:
+                self._entries.move_to_end(etag)
+                return cached, True
+
+        data, status = build()
+        cached = CachedResponse(etag, data, status)
+        with self._lock:
+            self._entries[etag] = cached
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached, False
+
+    def respond(self, version, key, build):
+        """Answers the current request from the cache.
+
+        build() returns (data, status) and is only called when no body for
+        this version and key is cached.
+        """
+        etag = self.etag_for(version, key)
+        # Each encoding is its own representation with its own strong ETag. 'If-None-Match: *' is
+        # not answered here: before build() runs there is no telling whether a body exists at all
+        if_none_match = request.if_none_match
+        for encoding in ('identity', 'gzip', 'br'):
+            tag = etag if encoding == 'identity' else f'{etag}-{encoding}'
+            if not if_none_match.star_tag and if_none_match.contains(tag):
+                REGISTRY.inc('scrapper_response_cache_total', result='not_modified')
+                response = Response(status=304)
+                response.set_etag(tag)
+                return self._finish(response)
+
+        cached, hit = self.get(etag, build)
+        REGISTRY.inc('scrapper_response_cache_total', result='hit' if hit else 'miss')
+
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in cached.bodies and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        response = Response(cached.bodies[encoding], status=cached.status, mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        # Only a successful body is a representation a client can revalidate
+        if cached.status == 200:
+            response.set_etag(etag if encoding == 'identity' else f'{etag}-{encoding}')
+        return self._finish(response)
+
+    @staticmethod
+    def _finish(response):
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Clients may keep the body but must revalidate it, which is a 304 while the data is unchanged
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
@@ -1,41 +1,123 @@
-import re
+import datetime
 import os
 from flask import jsonify
-from pdf_service import PDFService, PlaceMapService
-import concurrent.futures
+from pdf_service import PDFService, PlaceMapService, extract_gabs_document, parse_timetable_file_name
+from cache_service import ExtractionCache
+from extraction_engine import ExtractionEngine
+from sync_service import TimetableSync
+from snapshot_service import TimetableSnapshot
+import threading
+import heapq
+import logging
+from array import array
+from timetable_model import DAY_HEADINGS, PlaceSuggestIndex, PlaceTable, StopTimes, parse_time, parse_weekdays
+from metrics import REGISTRY, stage_timer
+
+logger = logging.getLogger(__name__)
 
 class Route:
-    def __init__(self, from_route, to_route, pdf, effective_date, time_table_no):
+    __slots__ = ('from_route', 'to_route', 'pdf', 'effective_date', 'end_date', 'time_table_no', 'place_table',
+                 'stops', 'service')
+
+    # Bump whenever add_tables changes which days a departure runs on; it is part of the snapshot signature
+    SERVICE_VERSION = 2
+
+    def __init__(self, from_route, to_route, pdf, effective_date, time_table_no, place_table=None, end_date='99999999'):
         self.from_route = from_route
         self.to_route = to_route
         self.pdf = pdf
         self.effective_date = effective_date
+        self.end_date = end_date
         self.time_table_no = time_table_no
-        self.places = []
-        self.places_map = {}
+        self.place_table = place_table if place_table is not None else PlaceTable()
+        # place id -> StopTimes, in the order the places appear in the PDF
+        self.stops = {}
+        # weekday (Monday = 0) -> place id -> StopTimes of the departures running that day;
+        # days with the same departures share one dict
+        self.service = {}
 
     def __str__(self):
         return f"Route({self.from_route} <-> {self.to_route}, Effective Date: {self.effective_date}, Time Table No: {self.time_table_no})"
 
+    @property
+    def family_key(self):
+        # Versions of a timetable are grouped like TimetableSync.supersession_key groups their files
+        return self.time_table_no[:4]
+
+    @property
+    def places(self):
+        return [self.place_table.name_of(place_id) for place_id in self.stops]
+
+    @property
+    def places_map(self):
+        return [{'name': self.place_table.name_of(place_id), 'times': stop.formatted()}
+                for place_id, stop in self.stops.items()]
+
     def add_places(self, places):
-        self.places = places
+        for place in places:
+            place_id = self.place_table.intern(place)
+            self.stops.setdefault(place_id, StopTimes(place_id))
 
     def add_places_map(self, places_map):
-        self.places_map = places_map
+        for place in places_map:
+            place_id = self.place_table.intern(place['name'])
+            self.stops[place_id] = StopTimes.from_strings(place_id, place.get('times', []))
+
+    def add_tables(self, tables, notes=None):
+        """Partitions the departures of the timetable grids by weekday.
+
+        A grid runs on the days of its heading (tables without one, such as
+        'NO SERVICE' pages, run on none), narrowed by the footnote printed next
+        to a time, e.g. 'b' for Fridays only. A time whose footnote names none
+        of the heading's days is dropped rather than run on the whole heading.
+        """
+        note_days = {ord(letter): set(parse_weekdays(days)) for letter, days in (notes or {}).items()}
+        departures = {}
+        dropped = 0
+        for table in tables:
+            weekdays = DAY_HEADINGS.get(table['day'])
+            if not weekdays:
+                continue
+            for name, cells in table['rows']:
+                place_id = self.place_table.intern(name)
+                for cell in cells:
+                    parsed = parse_time(cell)
+                    if not parsed:
+                        continue
+                    note = ord(parsed[1]) if parsed[1] else 0
+                    days = set(weekdays) & note_days[note] if note in note_days else weekdays
+                    if not days:
+                        dropped += 1
+                        continue
+                    for weekday in days:
+                        departures.setdefault(weekday, {}).setdefault(place_id, set()).add((parsed[0], note))
+        if dropped:
+            logger.warning("Dropped %d departures of %s whose footnote names none of their grid's days",
+                           dropped, self.pdf)
+
+        shared = {}
+        for weekday, places in sorted(departures.items()):
+            key = tuple((place_id, tuple(sorted(times))) for place_id, times in places.items())
+            if key not in shared:
+                shared[key] = {place_id: StopTimes.from_departures(place_id, times) for place_id, times in key}
+            self.service[weekday] = shared[key]
 
     def getRouteName(self):
         return f"{self.from_route} <-> {self.to_route}"
 
     def hasPlace(self, placeName):
-        return placeName.upper() in self.places
+        return self.place_table.id_of(placeName) in self.stops
+
+    def getStopTimes(self, placeName, weekday=None):
+        stops = self.stops if weekday is None else self.service.get(weekday, {})
+        return stops.get(self.place_table.id_of(placeName))
+
+    def in_force(self, date):
+        return self.effective_date <= date <= self.end_date
 
     def getPlaceTimes(self, placeName):
-        if self.hasPlace(placeName):
-            # Find the place in places_map by name and return its times
-            for place in self.places_map:
-                if place.get('name') == placeName:
-                    return place.get('times', [])
-        return []
+        stop = self.getStopTimes(placeName)
+        return stop.formatted() if stop else []
 
 
     def getCurrentPlaceAndDestinationRoute(self, placeName, dest, routes):
@@ -56,23 +138,119 @@ class Route:
         return []
 
 
+class RouteIndex:
+    """Inverted index from interned place id to the ids of the routes serving it.
+
+    Postings are kept for every day and per weekday, and the versions of each
+    timetable family are listed by effective date, so a dated query only
+    intersects that weekday's postings of the versions in force on the date.
+    """
+
+    def __init__(self, routes, place_table, version=None):
+        self.routes = routes
+        self.place_table = place_table
+        # Digest of the files and parser the index was built from, e.g. for HTTP ETags
+        self.version = version
+        self.place_routes = {}
+        # weekday (Monday = 0) -> place id -> ids of the routes serving it that day
+        self.day_place_routes = {}
+        # Route.family_key -> [(effective_date, route_id), ...], newest first
+        self.versions = {}
+        # 'YYYYMMDD' -> ids of the routes in force that day, filled in as dates are asked for
+        self._in_force = {}
+        for route_id, route in enumerate(routes):
+            for place_id in route.stops:
+                self.place_routes.setdefault(place_id, array('I')).append(route_id)
+            for weekday, stops in route.service.items():
+                day_routes = self.day_place_routes.setdefault(weekday, {})
+                for place_id in stops:
+                    day_routes.setdefault(place_id, array('I')).append(route_id)
+            self.versions.setdefault(route.family_key, []).append((route.effective_date, route_id))
+        for versions in self.versions.values():
+            versions.sort(reverse=True)
+        self.places = sorted(place_table.name_of(place_id) for place_id in self.place_routes)
+        self.place_suggestions = PlaceSuggestIndex(self.places)
+
+    def in_force(self, date):
+        """Returns the ids of the routes in force on date ('YYYYMMDD').
+
+        Per timetable family that is the newest version effective on or before
+        the date, unless its end date has passed.
+        """
+        route_ids = self._in_force.get(date)
+        if route_ids is None:
+            route_ids = set()
+            for versions in self.versions.values():
+                current = None
+                for effective_date, route_id in versions:
+                    if effective_date > date:
+                        continue
+                    if current is None:
+                        current = effective_date
+                    elif effective_date != current:
+                        break
+                    if self.routes[route_id].in_force(date):
+                        route_ids.add(route_id)
+            route_ids = frozenset(route_ids)
+            if len(self._in_force) >= 64:
+                self._in_force.clear()
+            self._in_force[date] = route_ids
+        return route_ids
+
+    def routes_with(self, *place_names, date=None, weekday=None):
+        """Returns the ids of the routes serving every one of the given places, in route order.
+
+        With a weekday only the departures running that day count, and with a
+        date only the routes in force on it.
+        """
+        place_ids = [self.place_table.id_of(name) for name in place_names]
+        if not place_ids or None in place_ids:
+            return []
+        place_routes = self.place_routes if weekday is None else self.day_place_routes.get(weekday, {})
+        postings = sorted((place_routes.get(place_id, ()) for place_id in place_ids), key=len)
+        route_ids = set(postings[0])
+        if date is not None:
+            route_ids.intersection_update(self.in_force(date))
+        for posting in postings[1:]:
+            route_ids.intersection_update(posting)
+        return sorted(route_ids)
+
+    def stop_times(self, route_id, place_name, weekday=None):
+        return self.routes[route_id].getStopTimes(place_name, weekday)
+
+    def place_times(self, route_id, place_name):
+        return self.routes[route_id].getPlaceTimes(place_name)
+
+    def all_places(self):
+        return self.places
+
+    def suggest_places(self, query, limit=10):
+        return self.place_suggestions.suggest(query, limit)
+
+
 class ScheduleService:
-    def __init__(self):
+    def __init__(self, pdf_service=None, snapshot_path='timetable_snapshot.bin', cache_folder='pdf_cache'):
         self.base_url = "https://scrapper-rsro.onrender.com"
-        self.pdf_service = PDFService()
-        self.place_service = PlaceMapService()
+        self.pdf_service = pdf_service or PDFService()
+        self.snapshot = TimetableSnapshot(snapshot_path) if snapshot_path else None
+        self.sync = TimetableSync(self.pdf_service)
+        self.cache = ExtractionCache(PlaceMapService.PARSER_VERSION, cache_folder)
+        self.extraction_engine = ExtractionEngine()
+        self.place_table = PlaceTable()
+        # (files signature, RouteIndex) swapped as one reference so readers never see a half-built state
+        self._index_state = None
+        self._index_lock = threading.Lock()
+        # Set when a RefreshWorker keeps the index current; readers then skip the per-request file check
+        self.background_refresh = False
 
     # Function to clean up the route data from the file name
     def clean_route_data(self, file_name):
-        match = re.match(r"([^_]+(?:_[^_]+)*)___([^_]+(?:_[^_]+)*)_from_(\d+)_to_(\d+)_([\d]+)\.pdf", file_name)
-        if match:
-            from_route = match.group(1).replace('_', ' ').title()
-            to_route = match.group(2).replace('_', ' ').title()
-            effective_date = match.group(3)
-            time_table_no = match.group(5)
-            print('clean data available')
-            return Route(from_route, to_route, file_name, effective_date, time_table_no)
-        print(file_name)
+        file_info = parse_timetable_file_name(file_name)
+        if file_info:
+            return Route(file_info['from_route'], file_info['to_route'], file_name,
+                         file_info['effective_date'], file_info['time_table_no'], self.place_table,
+                         file_info['end_date'])
+        logger.debug("Skipping %s: not a timetable file name", file_name)
         return None
 
     # Function to fetch the list of files
@@ -82,103 +260,220 @@ class ScheduleService:
             return {'files': response}
         return []
 
-    # Function to extract route data from the PDF file
+    # Function to extract route data from the PDF file, served from the on-disk cache when unchanged
     def extract_route_data(self, pdf_name):
-        print('extracting route data')
-        places = self.place_service.extract_text_from_pdf(pdf_name)
-        return {'places': places, 'placesMap': self.place_service.places_map}
-
-    # Function to get the routes, process file data, and extract additional details using threading
+        pdf_path = os.path.join(self.pdf_service.download_folder, pdf_name)
+        cached = self.cache.get(pdf_path)
+        REGISTRY.inc('scrapper_extraction_cache_total', result='hit' if cached is not None else 'miss')
+        if cached is not None:
+            return cached
+
+        logger.info("Extracting route data from %s", pdf_name)
+        extracted_data = extract_gabs_document(pdf_path)
+        self.cache.put(pdf_path, extracted_data)
+        return extracted_data
+
+    # Function to get the active routes, loading cached PDFs directly and extracting the rest in the process pool
     def get_routes(self):
-        files = self.get_files_list()['files']
+        files = self.sync.active_files()
         routes = []
-        extracted_data_list = []
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_route = {}
-
-            for file in files:
-                route = self.clean_route_data(file)
-                if route:
-                    # Submit the extraction task to the thread pool
-                    future = executor.submit(self.extract_route_data, route.pdf)
-                    future_to_route[future] = route
-                    routes.append(route)
-
-            # Collect results as they complete
-            for future in concurrent.futures.as_completed(future_to_route):
-                route = future_to_route[future]
-                try:
-                    extracted_data = future.result()
-                    if extracted_data:
-                        route.add_places(extracted_data['places'])
-                        route.add_places_map(extracted_data['placesMap'])
-                except Exception as e:
-                    print(f"Error processing {route.pdf}: {e}")
-
-        print(f'found {len(routes)} routes')
+        pending = {}
+
+        for file in files:
+            route = self.clean_route_data(file)
+            if not route:
+                continue
+            routes.append(route)
+            pdf_path = os.path.join(self.pdf_service.download_folder, route.pdf)
+            extracted_data = self.cache.get(pdf_path)
+            REGISTRY.inc('scrapper_extraction_cache_total', result='hit' if extracted_data is not None else 'miss')
+            if extracted_data is not None:
+                route.add_places(extracted_data['places'])
+                route.add_places_map(extracted_data['placesMap'])
+                route.add_tables(extracted_data['tables'], extracted_data['notes'])
+            else:
+                pending[pdf_path] = route
+
+        if pending:
+            logger.info("Extracting route data for %d PDFs", len(pending))
+            for pdf_path, extracted_data in self.extraction_engine.extract_all(extract_gabs_document, pending).items():
+                self.cache.put(pdf_path, extracted_data)
+                pending[pdf_path].add_places(extracted_data['places'])
+                pending[pdf_path].add_places_map(extracted_data['placesMap'])
+                pending[pdf_path].add_tables(extracted_data['tables'], extracted_data['notes'])
+
+        logger.debug("Found %d routes", len(routes))
+        return routes
+
+    # The snapshot holds parsed output split by weekday, so it is only valid for the parser and
+    # service partitioning that wrote it
+    def snapshot_signature(self, files_signature):
+        return [PlaceMapService.PARSER_VERSION, Route.SERVICE_VERSION, files_signature]
+
+    # Function to build routes from the memory-mapped snapshot, or None if it is missing or out of date
+    def load_snapshot_routes(self, files_signature):
+        records = self.snapshot.gabs_records(self.snapshot_signature(files_signature)) if self.snapshot else None
+        if records is None:
+            return None
+
+        routes = []
+        for route_info, stops, service in records:
+            route = Route(route_info['from_route'], route_info['to_route'], route_info['pdf'],
+                          route_info['effective_date'], route_info['time_table_no'], self.place_table,
+                          route_info['end_date'])
+            for place_name, minutes, notes in stops:
+                place_id = self.place_table.intern(place_name)
+                route.stops[place_id] = StopTimes(place_id, minutes, notes)
+            for weekdays, day_stops in service:
+                stops_by_place = {}
+                for place_name, minutes, notes in day_stops:
+                    place_id = self.place_table.intern(place_name)
+                    stops_by_place[place_id] = StopTimes(place_id, minutes, notes)
+                for weekday in weekdays:
+                    route.service[weekday] = stops_by_place
+            routes.append(route)
+        logger.info("Loaded %d routes from snapshot", len(routes))
         return routes
-    
-    # Method to find times for user location and destination
-    def find_times_for_location_and_destination(self, user_location, dest):
-        routes = self.get_routes()
-        times = []
 
-        # Loop through all routes and fetch times for the user location and destination
-        for route in routes:
-            # Check if the current route has the user location and destination
-            if route.hasPlace(user_location) and route.hasPlace(dest):
-                print(f'route: {route}')
-                # Get times for the user location
-                times_for_user = route.getPlaceTimes(user_location)
-                
-                if times_for_user:
-                    bus_details = f"Bus {route.getRouteName()} will arrive in {user_location} at: {', '.join(times_for_user)}"
-                    timeObject = {'times': times_for_user, 'user_location':user_location, 'destination': dest,'bus_route': route.getRouteName(), 'details':bus_details}
-                    times.append(timeObject)
+    @property
+    def route_index(self):
+        state = self._index_state
+        return state[1] if state else None
+
+    # Function to build a new, immutable route index for the given files without publishing it
+    def build_route_index(self, files_signature):
+        routes = self.load_snapshot_routes(files_signature)
+        if routes is None:
+            routes = self.get_routes()
+            if self.snapshot:
+                # Serve the fresh routes from the snapshot too, so their times live in the shared
+                # memory map rather than in this process' heap
+                self.snapshot.update_gabs(routes, self.snapshot_signature(files_signature))
+                routes = self.load_snapshot_routes(files_signature) or routes
+        with stage_timer('index_build'):
+            return RouteIndex(routes, self.place_table,
+                              TimetableSnapshot.signature_digest(self.snapshot_signature(files_signature)))
+
+    # Function to publish a new route index; in-flight readers keep the one they already hold
+    def swap_route_index(self, route_index, files_signature):
+        self._index_state = (files_signature, route_index)
+
+    # Function to build and publish the route index for the given files, under the same lock as the
+    # request path so only one thread at a time rebuilds (and rewrites the snapshot)
+    def rebuild_route_index(self, files_signature):
+        with self._index_lock:
+            route_index = self.build_route_index(files_signature)
+            with stage_timer('index_swap'):
+                self.swap_route_index(route_index, files_signature)
+            return route_index
+
+    # Function to pick up an index another process (the refresher) published: once the files changed,
+    # the new routes are loaded from the snapshot it wrote. Without a snapshot they are rebuilt from
+    # the extraction cache it filled.
+    def follow_route_index(self):
+        files_signature = self.sync.signature()
+        state = self._index_state
+        if state is not None and state[0] == files_signature:
+            return
+        with self._index_lock:
+            if self.snapshot:
+                routes = self.load_snapshot_routes(files_signature)
+                if routes is None:
+                    # Not written yet; the refresher is still working on it
+                    return
+                with stage_timer('index_build'):
+                    route_index = RouteIndex(routes, self.place_table, TimetableSnapshot.signature_digest(
+                        self.snapshot_signature(files_signature)))
+            else:
+                route_index = self.build_route_index(files_signature)
+            self.swap_route_index(route_index, files_signature)
+        logger.info("Reloaded the route index published by the refresher")
+
+    # Function to get the route index, rebuilt only when the downloaded PDFs or their sync state change
+    def get_route_index(self):
+        state = self._index_state
+        if state is not None and self.background_refresh:
+            return state[1]
+
+        files_signature = self.sync.signature()
+        if state is not None and state[0] == files_signature:
+            return state[1]
+        with self._index_lock:
+            state = self._index_state
+            if state is None or state[0] != files_signature:
+                self.swap_route_index(self.build_route_index(files_signature), files_signature)
+            return self._index_state[1]
+
+    # Method to find times for user location and destination, optionally only the departures
+    # between after and before (minutes since midnight) and at most limit of them across all routes.
+    # Only the timetables in force on date (a datetime.date, default today) are searched; given a
+    # date or a weekday (Monday = 0), only the departures running that day are returned.
+    def find_times_for_location_and_destination(self, user_location, dest, after=None, before=None, limit=None,
+                                                date=None, weekday=None):
+        with stage_timer('query'):
+            return self._find_times(self.get_route_index(), user_location, dest, after, before, limit, date, weekday)
+
+    # Method to answer many (user_location, dest, after, before, limit[, date, weekday]) queries against one route index.
+    # Yields each query's result in order, as find_times_for_location_and_destination would return it;
+    # repeated queries in the batch are answered once.
+    def find_times_batch(self, queries):
+        index = self.get_route_index()
+        answered = {}
+        for query in queries:
+            if query not in answered:
+                with stage_timer('query'):
+                    answered[query] = self._find_times(index, *query)
+            yield answered[query]
+
+    def _find_times(self, index, user_location, dest, after, before, limit, date=None, weekday=None):
+        times = []
+        if date is not None and weekday is None:
+            weekday = date.weekday()
+        date_key = (date or datetime.date.today()).strftime('%Y%m%d')
+
+        # Intersect the routes serving the user location with those serving the destination
+        matches = []
+        for route_id in index.routes_with(user_location, dest, date=date_key, weekday=weekday):
+            stop = index.stop_times(route_id, user_location, weekday)
+            start, end = stop.window(after, before, limit)
+            if start < end:
+                matches.append((route_id, stop, start, end))
+
+        # Keep only the overall earliest `limit` departures
+        if limit is not None:
+            earliest = heapq.nsmallest(limit, ((stop.minutes[i], n, i) for n, (_, stop, start, end) in enumerate(matches)
+                                               for i in range(start, end)))
+            ends = {}
+            for _, n, i in earliest:
+                ends[n] = max(ends.get(n, 0), i + 1)
+            matches = [(route_id, stop, start, ends[n]) for n, (route_id, stop, start, _) in enumerate(matches) if n in ends]
+
+        for route_id, stop, start, end in matches:
+            route = index.routes[route_id]
+            # Get times for the user location
+            times_for_user = stop.formatted(start, end)
+            bus_details = f"Bus {route.getRouteName()} will arrive in {user_location} at: {', '.join(times_for_user)}"
+            timeObject = {'times': times_for_user, 'user_location':user_location, 'destination': dest,'bus_route': route.getRouteName(), 'details':bus_details}
+            times.append(timeObject)
 
         # Output the times found
         if times:
-            for time in times:
-                print(time['details'])
+            logger.debug("Found %d schedules for %s to %s", len(times), user_location, dest)
             return times
         else:
             response = f"No schedule found for {user_location} to {dest}."
-            print(response)
+            logger.debug(response)
             return response
 
-    def clean_places(self, places):
-        invalid_patterns = [
-            r"^.*\b(STANDARD|SATURDAYS|SUNDAYS|OPERATED|REG|CONDITIONS|CARRIAGE|WEBSITE|LIABLE|ANY|LOSS|INCONVENIENCE|FAILURE|MAINTAIN|VEHICLES|TIMETABLE).*", # Regex for common invalid phrases
-            r"^[A-Za-z]+\.[A-Za-z]+$",  # Abbreviations like A.D.E.
-            r"^[A-Za-z]+\s*[A-Za-z]+$", # Single word place names (Optional if you want to keep these)
-            r"\(",  # If you want to remove places with parenthesis (like "MAMRE (PARADISE RD)")
-            r"^\s*$",  # Remove empty strings
-        ]
-
-        valid_places = []
-        
-        for place in places:
-            is_valid = True
-            for pattern in invalid_patterns:
-                if re.match(pattern, place):
-                    is_valid = False
-                    break
-            
-            if is_valid:
-                valid_places.append(place)
-
-        return valid_places
-
     # Method to get all available places
     def get_all_places(self):
-        all_places = set()  # Using a set to avoid duplicates
-        routes = self.get_routes()  # Assuming you already have the method to fetch routes
+        return self.get_route_index().all_places()
 
-        for route in routes:
-            all_places.update(route.places)  # Add places from each route
+    # Method to get at most limit place names completing what the user typed so far
+    def suggest_places(self, query, limit=10):
+        with stage_timer('suggest'):
+            return self.get_route_index().suggest_places(query, limit)
 
-        return sorted(all_places)
     
 
     
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+
+
+class TimetableSnapshot:
+    """Versioned binary snapshot of the parsed GABS and MyCiti timetables.
+
+    Layout: an 8 byte magic, a header (version, byte order, directory length),
+    a JSON directory with route metadata and array offsets, then the data
+    section holding every GABS stop's minutes (uint16) and footnotes (uint8),
+    for all days and per group of weekdays sharing the same departures. The
+    file is memory-mapped and the arrays are handed out as memoryviews, so
+    nothing is copied until it is read and the pages are shared between
+    processes through the OS page cache. MyCiti rows are kept in the
+    directory exactly as parsed.
+
+    Writes and re-maps are serialized by one lock; routes already handed out
+    keep reading the map they came from.
+    """
+
+    MAGIC = b'SCRPSNAP'
+    VERSION = 3
+    HEADER = struct.Struct('<8sHBxQ')
+
+    def __init__(self, path='timetable_snapshot.bin'):
+        self.path = path
+        self.directory = None
+        self._buffer = None
+        self._data_offset = 0
+        self._stat_key = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def signature_digest(signature):
+        return hashlib.sha1(json.dumps(signature).encode('utf-8')).hexdigest()
+
+    # Writing
+
+    def write(self, gabs_routes, gabs_signature, myciti_routes=None, myciti_signature=None):
+        """Serializes Route objects and MyCiti route dicts, replacing the snapshot atomically."""
+        with self._lock:
+            self._write(gabs_routes, self.signature_digest(gabs_signature), myciti_routes,
+                        self.signature_digest(myciti_signature) if myciti_signature is not None else None)
+
+    def update_gabs(self, gabs_routes, gabs_signature):
+        """Rewrites the snapshot with new GABS routes, carrying the current MyCiti routes over."""
+        with self._lock:
+            myciti_routes, myciti_digest = None, None
+            if self.open():
+                myciti_routes, myciti_digest = self._read_myciti(), self.directory['myciti_signature']
+            self._write(gabs_routes, self.signature_digest(gabs_signature), myciti_routes, myciti_digest)
+
+    def _write(self, gabs_routes, gabs_digest, myciti_routes, myciti_digest):
+        data = bytearray()
+
+        def add_arrays(minutes, notes):
+            offset = len(data)
+            data.extend(array('H', minutes).tobytes())
+            data.extend(array('B', notes).tobytes())
+            if len(data) % 2:
+                data.append(0)
+            return [offset, len(minutes)]
+
+        def add_stops(route, stops):
+            return [[route.place_table.name_of(place_id)] + add_arrays(stop.minutes, stop.notes)
+                    for place_id, stop in stops.items()]
+
+        gabs = []
+        for route in gabs_routes:
+            # Weekdays sharing one partition are written once
+            service = {}
+            for weekday, stops in sorted(route.service.items()):
+                service.setdefault(id(stops), [[], stops])[0].append(weekday)
+            gabs.append({
+                'from_route': route.from_route,
+                'to_route': route.to_route,
+                'pdf': route.pdf,
+                'effective_date': route.effective_date,
+                'end_date': route.end_date,
+                'time_table_no': route.time_table_no,
+                'stops': add_stops(route, route.stops),
+                'service': [[weekdays, add_stops(route, stops)] for weekdays, stops in service.values()],
+            })
+
+        myciti = []
+        for route_data in myciti_routes or []:
+            days = []
+            for day, stops in route_data.items():
+                if day == 'route':
+                    continue
+                days.append([day, [[stop_data['stop'], stop_data['times']] for stop_data in stops]])
+            myciti.append({'route': route_data.get('route'), 'days': days})
+
+        directory = json.dumps({
+            'gabs_signature': gabs_digest,
+            'myciti_signature': myciti_digest,
+            'gabs': gabs,
+            'myciti': myciti,
+        }).encode('utf-8')
+
+        byteorder = 0 if sys.byteorder == 'little' else 1
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, byteorder, len(directory))
+        padding = b'\0' * (-(len(header) + len(directory)) % 8)
+
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as snapshot_file:
+                snapshot_file.write(header)
+                snapshot_file.write(directory)
+                snapshot_file.write(padding)
+                snapshot_file.write(data)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # Reading
+
+    def open(self):
+        """Maps the snapshot file, re-mapping it if it was replaced. Returns False if unusable."""
+        with self._lock:
+            return self._open()
+
+    def _open(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.directory = None
+            return False
+        stat_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if stat_key == self._stat_key:
+            return self.directory is not None
+
+        self._stat_key = stat_key
+        self.directory = None
+        with open(self.path, 'rb') as snapshot_file:
+            if stat.st_size < self.HEADER.size:
+                return False
+            # Older maps stay alive for as long as routes built from them hold views into them
+            buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byteorder, directory_length = self.HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version != self.VERSION or byteorder != (0 if sys.byteorder == 'little' else 1):
+            return False
+
+        directory_end = self.HEADER.size + directory_length
+        self.directory = json.loads(buffer[self.HEADER.size:directory_end].decode('utf-8'))
+        self._buffer = memoryview(buffer)
+        self._data_offset = directory_end + (-directory_end % 8)
+        return True
+
+    def _arrays(self, offset, count):
+        start = self._data_offset + offset
+        minutes = self._buffer[start:start + 2 * count].cast('H')
+        notes = self._buffer[start + 2 * count:start + 3 * count]
+        return minutes, notes
+
+    def gabs_records(self, signature):
+        """Returns [(route_info, stops, service), ...] if the snapshot matches signature.
+
+        stops is [(place_name, minutes, notes), ...] for all days and service
+        is [(weekdays, stops), ...] for the departures running on those weekdays.
+        """
+        with self._lock:
+            if not self.open() or self.directory['gabs_signature'] != self.signature_digest(signature):
+                return None
+
+            def read_stops(stops):
+                return [(place_name,) + self._arrays(offset, count) for place_name, offset, count in stops]
+
+            records = []
+            for route in self.directory['gabs']:
+                service = [(weekdays, read_stops(stops)) for weekdays, stops in route['service']]
+                records.append((route, read_stops(route['stops']), service))
+            return records
+
+    def myciti_routes(self, signature):
+        """Returns the MyCiti routes in TimetableExtractor's dict format if the snapshot matches signature."""
+        with self._lock:
+            if not self.open() or self.directory['myciti_signature'] != self.signature_digest(signature):
+                return None
+            return self._read_myciti()
+
+    def _read_myciti(self):
+        routes_data = []
+        for route in self.directory['myciti']:
+            route_data = {'route': route['route']} if route['route'] else {}
+            for day, stops in route['days']:
+                route_data[day] = [{'stop': stop_name, 'times': list(times)} for stop_name, times in stops]
+            routes_data.append(route_data)
+        return routes_data
+
+
+def build_snapshot(path='timetable_snapshot.bin'):
+    """Parses every GABS and MyCiti timetable and writes them to a snapshot file."""
+    from schedule_service import ScheduleService
+    from my_citi_pdf_service import TimetableExtractor
+
+    schedule_service = ScheduleService(snapshot_path=None)
+    gabs_signature = schedule_service.snapshot_signature(schedule_service.sync.signature())
+    gabs_routes = schedule_service.get_routes()
+
+    extractor = TimetableExtractor(snapshot_path=None)
+    myciti_routes, myciti_signature = None, None
+    if os.path.isdir(extractor.download_folder):
+        myciti_signature = extractor.pdfs_signature()
+        myciti_routes = extractor.getAllRoutesData()
+
+    TimetableSnapshot(path).write(gabs_routes, gabs_signature, myciti_routes, myciti_signature)
+    print(f"Wrote {path} with {len(gabs_routes)} GABS and {len(myciti_routes or [])} MyCiti routes")
+
+
+if __name__ == '__main__':
+    build_snapshot(*sys.argv[1:2])
@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import time
+
+from pdf_service import parse_timetable_file_name
+
+
+class TimetableSync:
+    """Keeps the downloaded GABS timetables in line with the published ones.
+
+    A GABS timetable PDF carries every direction of a timetable family (the
+    first four digits of the timetable number) and is named after the page
+    that changed last, so for each family only the version in force today and
+    any published for a later date are kept active. The same printing is
+    published under the name of every corridor it serves; only the first of
+    those copies is kept. Older and expired versions, other copies and files
+    that are no longer published stay on disk but are marked inactive in the
+    sync manifest.
+    """
+
+    MANIFEST_FILE = '.sync_manifest.json'
+
+    def __init__(self, pdf_service):
+        self.pdf_service = pdf_service
+        # ((files signature, manifest mtime, date), active files) of the last signature() call
+        self._active_state = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.pdf_service.download_folder, self.MANIFEST_FILE)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        fd, tmp_path = tempfile.mkstemp(dir=self.pdf_service.download_folder, prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def supersession_key(file_info):
+        return file_info['time_table_no'][:4]
+
+    def resolve(self, file_names, published=None, today=None):
+        """Splits file names into active, superseded and withdrawn lists.
+
+        Files missing from `published` (when given) are withdrawn. Names that
+        do not follow the timetable naming scheme are left active. `today`
+        ('YYYYMMDD') defaults to the current date.
+        """
+        today = today or time.strftime('%Y%m%d')
+        in_force = {}
+        candidates = []
+        withdrawn = []
+        for file_name in sorted(set(file_names)):
+            if published is not None and file_name not in published:
+                withdrawn.append(file_name)
+                continue
+            file_info = parse_timetable_file_name(file_name)
+            candidates.append((file_name, file_info))
+            if file_info and file_info['effective_date'] <= today:
+                key = self.supersession_key(file_info)
+                in_force[key] = max(in_force.get(key, ''), file_info['effective_date'])
+
+        active = []
+        superseded = []
+        printings = set()
+        for file_name, file_info in candidates:
+            if file_info:
+                printing = self.supersession_key(file_info), file_info['effective_date']
+                if (file_info['effective_date'] < in_force.get(printing[0], '') or file_info['end_date'] < today
+                        or printing in printings):
+                    superseded.append(file_name)
+                    continue
+                printings.add(printing)
+            active.append(file_name)
+        return active, superseded, withdrawn
+
+    def active_files(self):
+        """Returns the downloaded timetables that are currently in force."""
+        published = self.load_manifest().get('published')
+        active, _, _ = self.resolve(self.pdf_service.list_downloaded_pdfs(),
+                                    set(published) if published is not None else None)
+        return active
+
+    def signature(self):
+        """Fingerprint of the downloaded files, the manifest and which of them are active, for cache invalidation.
+
+        The active files are included because they change with the date alone,
+        when a published future version comes into force.
+        """
+        try:
+            manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            manifest_mtime = None
+        files_signature = self.pdf_service.downloaded_pdfs_signature()
+        # Resolved again only when the files, the manifest or the date changed
+        key = (files_signature, manifest_mtime, time.strftime('%Y%m%d'))
+        state = self._active_state
+        if state is None or state[0] != key:
+            state = self._active_state = (key, self.active_files())
+        return files_signature, manifest_mtime, state[1]
+
+    def sync(self, progress=None):
+        """Fetches the published links and downloads only new or changed, non-superseded timetables.
+
+        `progress(stage, done, total)` is called as links are fetched and files downloaded, if given.
+        An empty listing raises RuntimeError and leaves the files and the manifest as they are.
+        """
+        if progress:
+            progress('fetch_links', 0, None)
+        published = {pdf_url.split('/')[-1]: pdf_url for pdf_url in self.pdf_service.fetch_pdf_links()}
+        # A listing without a single timetable is a broken page, not every timetable being withdrawn
+        if not published:
+            raise RuntimeError(f"No timetable links found on {self.pdf_service.url}")
+        on_disk = self.pdf_service.list_downloaded_pdfs()
+        active, superseded, withdrawn = self.resolve(set(published) | set(on_disk), set(published))
+
+        # Files already on disk go out as conditional requests and come back as a 304 when unchanged
+        to_download = [published[file_name] for file_name in active]
+        if progress:
+            progress('download', 0, len(to_download))
+        statuses = self.pdf_service.downloader.download_all(
+            to_download, progress=(lambda done, total: progress('download', done, total)) if progress else None)
+
+        report = {
+            'synced_at': int(time.time()),
+            'published': sorted(published),
+            'active': active,
+            'superseded': superseded,
+            'withdrawn': [file_name for file_name in withdrawn if file_name in on_disk],
+            'downloaded': sorted(url.split('/')[-1] for url, status in statuses.items() if status == 'downloaded'),
+            'not_modified': sorted(url.split('/')[-1] for url, status in statuses.items() if status == 'not_modified'),
+            'failed': sorted(url.split('/')[-1] for url, status in statuses.items() if status == 'failed'),
+        }
+        self._save_manifest(report)
+        return report
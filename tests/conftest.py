@@ -0,0 +1,58 @@
+import pytest
+
+from pdf_service import PDFService
+from response_cache import ResponseCache
+from schedule_service import Route, RouteIndex, ScheduleService
+from timetable_model import PlaceTable, parse_time
+
+NOTES = {'b': 'Fridays'}
+# (from, to, pdf, effective date, timetable number, tables) of a small network: two versions of
+# timetable 0120 and one of 0440, all serving Bellville and Cape Town
+ROUTES = [
+    ('Bellville', 'Cape Town', 'old.pdf', '20240101', '012001', [
+        {'day': 'MONDAYS TO FRIDAYS', 'rows': [['BELLVILLE', ['05:00']], ['CAPE TOWN', ['06:00']]]},
+    ]),
+    ('Bellville', 'Cape Town', 'current.pdf', '20250101', '012001', [
+        {'day': 'MONDAYS TO FRIDAYS', 'rows': [['BELLVILLE', ['06:00', '07:30', '16:00b']],
+                                               ['CAPE TOWN', ['07:00', '08:30', '17:00b']]]},
+        {'day': 'SATURDAYS', 'rows': [['BELLVILLE', ['09:00']], ['CAPE TOWN', ['10:00']]]},
+    ]),
+    ('Bellville', 'Mowbray', 'mowbray.pdf', '20250101', '044001', [
+        {'day': 'MONDAYS TO FRIDAYS', 'rows': [['BELLVILLE', ['06:30', '--']], ['MOWBRAY', ['06:50', '--']],
+                                               ['CAPE TOWN', ['07:20', '--']]]},
+    ]),
+]
+
+
+def make_route_index(place_table, version='test'):
+    routes = []
+    for from_route, to_route, pdf, effective_date, time_table_no, tables in ROUTES:
+        route = Route(from_route, to_route, pdf, effective_date, time_table_no, place_table)
+        places = {}
+        for table in tables:
+            for name, cells in table['rows']:
+                places.setdefault(name, []).extend(cell for cell in cells if parse_time(cell))
+        route.add_places_map([{'name': name, 'times': times} for name, times in places.items()])
+        route.add_tables(tables, NOTES)
+        routes.append(route)
+    return RouteIndex(routes, place_table, version)
+
+
+@pytest.fixture
+def schedule_service(tmp_path):
+    """A ScheduleService serving the ROUTES network, without any PDFs or refreshes."""
+    service = ScheduleService(PDFService(str(tmp_path / 'pdf_downloads')), snapshot_path=None,
+                              cache_folder=str(tmp_path / 'pdf_cache'))
+    service.swap_route_index(make_route_index(service.place_table), None)
+    service.background_refresh = True
+    return service
+
+
+@pytest.fixture
+def client(schedule_service, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, 'schedule_service', schedule_service)
+    monkeypatch.setattr(app_module, 'response_cache', ResponseCache())
+    monkeypatch.setitem(app_module.app.config, 'REFRESH_WORKER', False)
+    return app_module.app.test_client()
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+
+def schedules(client, headers=None, **params):
+    return client.get('/schedules', query_string={'user_location': 'BELLVILLE', 'destination': 'CAPE TOWN',
+                                                  'date': '2025-03-07', **params}, headers=headers)
+
+
+def test_schedules_next_departures(client):
+    response = schedules(client, after='07:00', before='16:00', limit='5')
+    assert response.status_code == 200
+    assert [entry['times'] for entry in response.get_json()['times']] == [['07:30', '16:00b']]
+
+
+@pytest.mark.parametrize('params', [
+    {'after': '07:99'},
+    {'before': '24:00'},
+    {'after': '7am'},
+    {'limit': '0'},
+    {'limit': 'two'},
+    {'date': '2025-02-30'},
+    {'day': 'someday'},
+])
+def test_schedules_rejects_bad_input(client, params):
+    response = schedules(client, **params)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_schedules_batch_answers_each_entry(client):
+    response = client.post('/schedules/batch', json={'queries': [
+        {'user_location': 'BELLVILLE', 'destination': 'CAPE TOWN', 'date': '2025-03-08'},
+        {'user_location': 'BELLVILLE'},
+        {'user_location': 'BELLVILLE', 'destination': 'CAPE TOWN', 'after': '07:99'},
+        'BELLVILLE',
+        {'user_location': 'BELLVILLE', 'destination': 'NOWHERE'},
+        {'user_location': 'BELLVILLE', 'destination': 'CAPE TOWN', 'date': '2025-03-08', 'limit': True},
+    ]})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(line['index'], line['status']) for line in lines] == [(0, 200), (1, 400), (2, 400), (3, 400), (4, 404), (5, 400)]
+    assert [entry['times'] for entry in lines[0]['times']] == [['09:00']]
+    assert lines[1]['error'] == 'Missing user_location or destination'
+    assert lines[2]['error'] == 'after must be a time in HH:MM format'
+
+
+@pytest.mark.parametrize('body', [{'queries': 'BELLVILLE'}, 'BELLVILLE'])
+def test_schedules_batch_rejects_other_bodies(client, body):
+    assert client.post('/schedules/batch', json=body).status_code == 400
+
+
+def test_schedules_batch_limit(client, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, 'BATCH_LIMIT', 1)
+    queries = [{'user_location': 'BELLVILLE', 'destination': 'CAPE TOWN'}] * 2
+    assert client.post('/schedules/batch', json={'queries': queries}).status_code == 413
+
+
+
+def test_schedules_revalidates_with_etag(client):
+    response = schedules(client)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag'].strip('"')
+
+    revalidated = schedules(client, headers={'If-None-Match': f'"{etag}"'})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+    # Another query is another representation
+    assert schedules(client, headers={'If-None-Match': f'"{etag}"'}, after='07:00').status_code == 200
+
+
+def test_schedules_not_found_is_not_revalidated(client):
+    response = schedules(client, user_location='NOPE')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+    assert schedules(client, headers={'If-None-Match': '*'}, user_location='NOPE').status_code == 404
+    assert schedules(client, headers={'If-None-Match': '*'}).status_code == 200
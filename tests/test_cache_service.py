@@ -0,0 +1,58 @@
+import os
+
+from cache_service import ExtractionCache
+
+
+def make_pdf(tmp_path, content=b'%PDF-1.4 timetable'):
+    pdf_path = tmp_path / 'route.pdf'
+    pdf_path.write_bytes(content)
+    return str(pdf_path)
+
+
+def touch(pdf_path):
+    stat = os.stat(pdf_path)
+    os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_get_returns_stored_data(tmp_path):
+    pdf_path = make_pdf(tmp_path)
+    cache = ExtractionCache(4, str(tmp_path / 'cache'))
+    assert cache.get(pdf_path) is None
+    cache.put(pdf_path, {'places': ['BELLVILLE']})
+    assert cache.get(pdf_path) == {'places': ['BELLVILLE']}
+    # Keyed by the normalized path
+    assert cache.get(os.path.join(str(tmp_path), '.', 'route.pdf')) == {'places': ['BELLVILLE']}
+
+
+def test_get_misses_for_another_parser_version(tmp_path):
+    pdf_path = make_pdf(tmp_path)
+    ExtractionCache(4, str(tmp_path / 'cache')).put(pdf_path, {'places': []})
+    assert ExtractionCache(5, str(tmp_path / 'cache')).get(pdf_path) is None
+
+
+def test_get_misses_for_changed_or_removed_file(tmp_path):
+    pdf_path = make_pdf(tmp_path)
+    cache = ExtractionCache(4, str(tmp_path / 'cache'))
+    cache.put(pdf_path, {'places': []})
+
+    # Same size, new content and mtime
+    make_pdf(tmp_path, b'%PDF-1.4 timetablf')
+    touch(pdf_path)
+    assert cache.get(pdf_path) is None
+
+    cache.put(pdf_path, {'places': []})
+    make_pdf(tmp_path, b'%PDF-1.4 longer timetable')
+    assert cache.get(pdf_path) is None
+
+    os.remove(pdf_path)
+    assert cache.get(pdf_path) is None
+
+
+def test_get_trusts_content_hash_of_touched_file(tmp_path):
+    pdf_path = make_pdf(tmp_path)
+    cache = ExtractionCache(4, str(tmp_path / 'cache'))
+    cache.put(pdf_path, {'places': ['BELLVILLE']})
+    touch(pdf_path)
+    assert cache.get(pdf_path) == {'places': ['BELLVILLE']}
+    # The new mtime is recorded, so the next lookup skips hashing
+    assert cache._read_entry(pdf_path)['mtime_ns'] == os.stat(pdf_path).st_mtime_ns
@@ -0,0 +1,68 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from download_service import DownloadEngine
+
+PDF = b'%PDF-1.4 timetable'
+ETAG = '"v1"'
+
+
+class TimetableHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get('If-None-Match')))
+        if self.path != '/route.pdf':
+            self.send_response(404)
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Length', str(len(PDF)))
+            self.end_headers()
+            self.wfile.write(PDF)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    TimetableHandler.requests_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TimetableHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_revalidates_with_etag(tmp_path, server_url):
+    engine = DownloadEngine(str(tmp_path), max_retries=0)
+    assert engine.download(f'{server_url}/route.pdf') == 'downloaded'
+    assert (tmp_path / 'route.pdf').read_bytes() == PDF
+
+    # A new engine picks the validators up from the meta file
+    engine = DownloadEngine(str(tmp_path), max_retries=0)
+    assert engine.download(f'{server_url}/route.pdf') == 'not_modified'
+    assert TimetableHandler.requests_seen == [('/route.pdf', None), ('/route.pdf', ETAG)]
+
+    # Without the file on disk there is nothing to revalidate
+    os.remove(tmp_path / 'route.pdf')
+    assert engine.download(f'{server_url}/route.pdf') == 'downloaded'
+    assert TimetableHandler.requests_seen[-1] == ('/route.pdf', None)
+
+
+def test_download_failure_leaves_no_file(tmp_path, server_url):
+    engine = DownloadEngine(str(tmp_path), max_retries=0)
+    assert engine.download_all([f'{server_url}/missing.pdf', (f'{server_url}/route.pdf', 'renamed.pdf')]) == {
+        f'{server_url}/missing.pdf': 'failed',
+        f'{server_url}/route.pdf': 'downloaded',
+    }
+    assert sorted(os.listdir(tmp_path)) == [DownloadEngine.META_FILE, 'renamed.pdf']
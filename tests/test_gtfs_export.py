@@ -0,0 +1,26 @@
+from gtfs_export import MYCITI_FEED_START, myciti_fragment
+
+ROUTE_DATA = {
+    'route': {'code': 'T01', 'description': 'Dunoon - Civic Centre', 'effective_date': '20250303'},
+    'MONDAYS TO FRIDAYS': [{'stop': 'Dunoon', 'times': ['05:00', '05:30']},
+                           {'stop': 'Civic Centre', 'times': ['05:40', '06:10']}],
+    # Stops listing different numbers of times cannot be paired into trips
+    'SATURDAYS': [{'stop': 'Dunoon', 'times': ['06:00']}, {'stop': 'Civic Centre', 'times': []}],
+}
+
+
+def test_myciti_fragment_starts_on_effective_date():
+    fragment = myciti_fragment('myciti_pdfs/T01-timetable.pdf', ROUTE_DATA)
+    assert list(fragment['services'].values()) == [['1111100', '20250303', '20991231']]
+    assert list(fragment['groups']) == ['T01|MONDAYS TO FRIDAYS']
+    trips = fragment['groups']['T01|MONDAYS TO FRIDAYS']['trips']
+    assert [stop_times for _, _, _, _, stop_times in trips] == [
+        [['MYCITI-DUNOON', 300], ['MYCITI-CIVIC_CENTRE', 340]],
+        [['MYCITI-DUNOON', 330], ['MYCITI-CIVIC_CENTRE', 370]],
+    ]
+
+
+def test_myciti_fragment_without_effective_date_starts_on_fixed_date():
+    route_data = dict(ROUTE_DATA, route={'code': 'T01', 'description': 'Dunoon - Civic Centre'})
+    fragment = myciti_fragment('myciti_pdfs/T01-timetable.pdf', route_data)
+    assert [service[1] for service in fragment['services'].values()] == [MYCITI_FEED_START]
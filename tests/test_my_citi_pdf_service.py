@@ -0,0 +1,41 @@
+from my_citi_pdf_service import TimetableExtractor
+
+TEXT = ("T01: Dunoon - Table View - Civic Centre\n"
+        "MONDAYS TO FRIDAYS\nDunoon 05:00 05:30\nTable View 05:20 05:50\n"
+        "SATURDAYS\nDunoon 06:00\n"
+        # The weekday heading again on the next page
+        "MONDAYS TO FRIDAYS\nCivic Centre 06:10 06:40\n")
+
+
+def test_parse_timetable_data_by_day():
+    timetable_data = TimetableExtractor(snapshot_path=None).parse_timetable_data(TEXT)
+    assert timetable_data['route']['code'] == 'T01'
+    assert timetable_data['route']['description'].startswith('Dunoon - Table View - Civic Centre')
+    assert timetable_data['MONDAYS TO FRIDAYS'] == [
+        {'stop': 'Dunoon', 'times': ['05:00', '05:30']},
+        {'stop': 'Table View', 'times': ['05:20', '05:50']},
+        {'stop': 'Civic Centre', 'times': ['06:10', '06:40']},
+    ]
+    assert timetable_data['SATURDAYS'] == [{'stop': 'Dunoon', 'times': ['06:00']}]
+
+
+def test_iter_timetable_sections_skips_nothing_between_headings():
+    sections = list(TimetableExtractor(snapshot_path=None).iter_timetable_sections(TEXT))
+    assert [(section, stop) for section, stop, _ in sections if section != 'route'] == [
+        ('MONDAYS TO FRIDAYS', 'Dunoon'),
+        ('MONDAYS TO FRIDAYS', 'Table View'),
+        ('SATURDAYS', 'Dunoon'),
+        ('MONDAYS TO FRIDAYS', 'Civic Centre'),
+    ]
+
+
+def test_parse_timetable_data_without_day_headings():
+    assert TimetableExtractor(snapshot_path=None).parse_timetable_data('Dunoon 05:00 05:30\n') == {}
+
+
+def test_parse_timetable_data_effective_date():
+    extractor = TimetableExtractor(snapshot_path=None)
+    for printed in ('EFFECTIVE FROM: 3 March 2025', 'Valid from 2025/03/03', 'EFFECTIVE DATE 03/03/2025'):
+        assert extractor.parse_timetable_data(f'{printed}\n{TEXT}')['route']['effective_date'] == '20250303'
+    assert 'effective_date' not in extractor.parse_timetable_data(TEXT)['route']
+    assert 'effective_date' not in extractor.parse_timetable_data(f'EFFECTIVE FROM 31 Smarch 2025\n{TEXT}')['route']
@@ -0,0 +1,51 @@
+import os
+
+from pdf_service import PlaceMapService
+
+DOWNLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'pdf_downloads')
+
+# Two timetables of 2025/01/13, one per direction, with the 'a' and 'b' footnotes
+PDF = 'AIRPORT_IND___BLUEDOWNS_from_20250113_to_99999999_012901.pdf'
+
+
+def test_split_word_centres_pieces_on_their_characters():
+    service = PlaceMapService()
+    assert service.split_word((0, 0, 8, 1, '|AB|')) == [(1, '|'), (4, 'AB'), (7, '|')]
+    assert service.split_word((0, 0, 10, 1, '05:10')) == [(5, '05:10')]
+
+
+def test_read_grid_splits_bands_at_headings():
+    lines = [
+        [(5, 'MONDAYS'), (15, 'TO'), (25, 'FRIDAYS')],
+        [(0, '|'), (10, 'AIRPORT'), (15, 'IND'), (20, '|'), (25, '06:45'), (30, '|'), (40, '|')],
+        [(0, '|'), (10, 'BELHAR'), (20, '|'), (35, 'via'), (40, '|')],
+        [(0, '|'), (20, '----'), (40, '|')],
+        [(5, 'SATURDAYS')],
+        [(0, '|'), (10, 'BELHAR'), (20, '|'), (25, '07:00a'), (30, '|'), (35, '--'), (40, '|')],
+    ]
+    assert PlaceMapService().read_grid(lines) == [
+        ([['AIRPORT IND', ['06:45', '']], ['BELHAR', ['', 'via']]], ['MONDAYS TO FRIDAYS']),
+        ([['BELHAR', ['07:00a', '--']]], ['SATURDAYS']),
+    ]
+
+
+def test_read_grid_without_columns():
+    assert PlaceMapService().read_grid([[(5, 'SATURDAYS')]]) == []
+
+
+def test_extract_document():
+    extracted = PlaceMapService(DOWNLOAD_FOLDER).extract_document(PDF)
+    tables = extracted['tables']
+    assert [(table['page'], table['day'], table['time_table_no']) for table in tables] == \
+        [(0, 'MONDAYS TO FRIDAYS', '0129 01'), (1, 'MONDAYS TO FRIDAYS', '0129 02')]
+    assert {table['effective_date'] for table in tables} == {'2025/01/13'}
+    assert extracted['notes'] == {'a': 'Mondays,Tuesdays,Wednesdays,Thursdays', 'b': 'Fridays'}
+    assert all(len(cells) == PlaceMapService.TIME_COLUMNS for table in tables for _, cells in table['rows'])
+    assert tables[1]['rows'][0][1][:4] == ['16:00b', '17:00a', '17:00a', '--']
+
+    # The places map holds the times of every grid, once each in the order printed
+    places = {place['name']: place for place in extracted['placesMap']}
+    assert places['ELECTRIC CITY']['times'] == ['05:10', '17:50b', '18:20a']
+    assert places['ELECTRIC CITY']['next'] == 'BLUE DOWNS'
+    assert places['AIRPORT IND 2']['times'] == ['16:00b', '17:00a']
+    assert extracted['places'] == list(places)
@@ -0,0 +1,52 @@
+import gzip
+import json
+
+from flask import Flask
+
+from response_cache import ResponseCache
+
+app = Flask(__name__)
+DATA = {'places': [f'PLACE {i}' for i in range(200)]}
+
+
+def respond(cache, builds, headers=None, version=1):
+    def build():
+        builds.append(1)
+        return DATA, 200
+
+    with app.test_request_context('/places', headers=headers or {}):
+        return cache.respond(version, ('places',), build)
+
+
+def test_body_is_built_once_per_version():
+    cache, builds = ResponseCache(), []
+    first = respond(cache, builds)
+    assert json.loads(first.get_data()) == DATA
+    assert respond(cache, builds).get_data() == first.get_data()
+    assert len(builds) == 1
+    respond(cache, builds, version=2)
+    assert len(builds) == 2
+
+
+def test_each_encoding_revalidates_with_its_own_etag():
+    cache, builds = ResponseCache(), []
+    plain = respond(cache, builds)
+    compressed = respond(cache, builds, {'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(compressed.get_data())) == DATA
+    assert compressed.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+
+    for response in (plain, compressed):
+        revalidated = respond(cache, builds, {'If-None-Match': response.headers['ETag']})
+        assert revalidated.status_code == 304
+        assert revalidated.headers['ETag'] == response.headers['ETag']
+    assert respond(cache, builds, {'If-None-Match': plain.headers['ETag']}, version=2).status_code == 200
+
+
+def test_lru_evicts_oldest_versions():
+    cache, builds = ResponseCache(max_entries=1), []
+    respond(cache, builds, version=1)
+    respond(cache, builds, version=2)
+    respond(cache, builds, version=1)
+    assert len(builds) == 3
@@ -0,0 +1,120 @@
+import datetime
+
+from schedule_service import Route, RouteIndex
+from timetable_model import PlaceTable
+
+NOTES = {'a': 'Mondays,Tuesdays,Wednesdays,Thursdays', 'b': 'Fridays', 'c': 'Saturdays'}
+
+
+def make_route(tables, notes=NOTES):
+    route = Route('ELECTRIC CITY', 'AIRPORT IND', 'test.pdf', '20250113', '0129 01')
+    route.add_tables(tables, notes)
+    return route
+
+
+def times(route, name, weekday):
+    stop = route.getStopTimes(name, weekday)
+    return stop.formatted() if stop else []
+
+
+def test_add_tables_runs_grid_on_heading_days():
+    route = make_route([
+        {'day': 'MONDAYS TO FRIDAYS', 'rows': [['ELECTRIC CITY', ['05:10', 'via', '--']]]},
+        {'day': 'SATURDAYS', 'rows': [['ELECTRIC CITY', ['07:00']]]},
+        {'day': None, 'rows': [['ELECTRIC CITY', ['09:00']]]},
+    ])
+    assert [times(route, 'ELECTRIC CITY', weekday) for weekday in range(7)] == \
+        [['05:10']] * 5 + [['07:00'], []]
+    # Weekdays with the same departures share one dict
+    assert route.service[0] is route.service[4]
+
+
+def test_add_tables_narrows_grid_by_footnote():
+    route = make_route([{'day': 'MONDAYS TO FRIDAYS', 'rows': [['ELECTRIC CITY', ['16:00b', '17:00a', '18:20']]]}])
+    assert times(route, 'ELECTRIC CITY', 0) == ['17:00a', '18:20']
+    assert times(route, 'ELECTRIC CITY', 3) == ['17:00a', '18:20']
+    assert times(route, 'ELECTRIC CITY', 4) == ['16:00b', '18:20']
+
+
+def test_add_tables_keeps_undefined_footnote_on_heading_days():
+    route = make_route([{'day': 'SATURDAYS', 'rows': [['ELECTRIC CITY', ['08:00z']]]}])
+    assert times(route, 'ELECTRIC CITY', 5) == ['08:00z']
+
+
+def test_add_tables_drops_footnote_outside_heading_days():
+    route = make_route([{'day': 'MONDAYS TO FRIDAYS', 'rows': [['ELECTRIC CITY', ['06:00c', '07:00']]]}])
+    assert [times(route, 'ELECTRIC CITY', weekday) for weekday in range(7)] == [['07:00']] * 5 + [[], []]
+
+
+def make_index(*versions):
+    place_table = PlaceTable()
+    routes = []
+    for time_table_no, effective_date, end_date in versions:
+        route = Route('A', 'B', f'{time_table_no}-{effective_date}.pdf', effective_date, time_table_no,
+                      place_table=place_table, end_date=end_date)
+        route.add_places(['A', 'B'])
+        routes.append(route)
+    return RouteIndex(routes, place_table)
+
+
+def test_in_force_picks_newest_effective_version():
+    index = make_index(('0129 01', '20250101', '99999999'),
+                       ('0129 01', '20250301', '99999999'),
+                       ('0044 01', '20250201', '99999999'))
+    assert index.in_force('20241231') == set()
+    assert index.in_force('20250201') == {0, 2}
+    assert index.in_force('20250301') == {1, 2}
+
+
+def test_in_force_keeps_every_route_of_the_current_date():
+    # Both directions of a timetable share a family and an effective date
+    index = make_index(('0129 01', '20250101', '99999999'),
+                       ('0129 02', '20250101', '99999999'),
+                       ('0129 01', '20240101', '99999999'))
+    assert index.in_force('20250601') == {0, 1}
+    assert index.in_force('20240601') == {2}
+
+
+def test_in_force_does_not_fall_back_past_an_end_date():
+    index = make_index(('0129 01', '20240101', '99999999'),
+                       ('0129 01', '20250101', '20250131'))
+    assert index.in_force('20250115') == {1}
+    assert index.in_force('20250201') == set()
+
+
+def departures(schedule_service, after=None, before=None, limit=None, date=None, weekday=None):
+    found = schedule_service.find_times_for_location_and_destination('BELLVILLE', 'CAPE TOWN', after, before, limit,
+                                                                     date, weekday)
+    return [(entry['bus_route'], entry['times']) for entry in found] if isinstance(found, list) else found
+
+
+def test_find_times_for_date_and_weekday(schedule_service):
+    monday, friday, saturday = datetime.date(2025, 3, 3), datetime.date(2025, 3, 7), datetime.date(2025, 3, 8)
+    assert departures(schedule_service, date=monday) == [
+        ('Bellville <-> Cape Town', ['06:00', '07:30']),
+        ('Bellville <-> Mowbray', ['06:30']),
+    ]
+    assert departures(schedule_service, date=friday)[0] == ('Bellville <-> Cape Town', ['06:00', '07:30', '16:00b'])
+    assert departures(schedule_service, date=saturday) == [('Bellville <-> Cape Town', ['09:00'])]
+    # The version in force before 2025 only
+    assert departures(schedule_service, date=datetime.date(2024, 6, 3)) == [('Bellville <-> Cape Town', ['05:00'])]
+    assert departures(schedule_service, date=friday, weekday=5) == [('Bellville <-> Cape Town', ['09:00'])]
+
+
+def test_find_times_after_before_limit(schedule_service):
+    friday = datetime.date(2025, 3, 7)
+    assert departures(schedule_service, after=6 * 60 + 30, date=friday) == [
+        ('Bellville <-> Cape Town', ['07:30', '16:00b']),
+        ('Bellville <-> Mowbray', ['06:30']),
+    ]
+    assert departures(schedule_service, before=7 * 60 + 30, date=friday) == [
+        ('Bellville <-> Cape Town', ['06:00', '07:30']),
+        ('Bellville <-> Mowbray', ['06:30']),
+    ]
+    # The earliest departures across all routes
+    assert departures(schedule_service, limit=2, date=friday) == [
+        ('Bellville <-> Cape Town', ['06:00']),
+        ('Bellville <-> Mowbray', ['06:30']),
+    ]
+    assert departures(schedule_service, after=17 * 60, date=friday) == \
+        "No schedule found for BELLVILLE to CAPE TOWN."
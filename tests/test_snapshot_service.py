@@ -0,0 +1,61 @@
+from schedule_service import Route
+from snapshot_service import TimetableSnapshot
+from timetable_model import PlaceTable
+
+MYCITI = [{'route': {'code': 'T01', 'description': 'Dunoon - Table View - Civic Centre', 'effective_date': '20250301'},
+           'WEEKDAYS': [{'stop': 'Dunoon', 'times': ['05:00', '05:30']}, {'stop': 'Civic', 'times': ['06:00']}]}]
+
+
+def make_route():
+    route = Route('Bellville', 'Cape Town', 'route.pdf', '20250113', '012001', PlaceTable())
+    route.add_places_map([{'name': 'BELLVILLE', 'times': ['06:00', '16:00b']}, {'name': 'CAPE TOWN', 'times': ['07:00']}])
+    route.add_tables([
+        {'day': 'MONDAYS TO FRIDAYS', 'rows': [['BELLVILLE', ['06:00', '16:00b']], ['CAPE TOWN', ['07:00', '--']]]},
+    ], {'b': 'Fridays'})
+    return route
+
+
+def test_gabs_round_trip(tmp_path):
+    snapshot = TimetableSnapshot(str(tmp_path / 'snapshot.bin'))
+    snapshot.write([make_route()], ['files', 1])
+
+    [(route_info, stops, service)] = TimetableSnapshot(snapshot.path).gabs_records(['files', 1])
+    assert (route_info['from_route'], route_info['effective_date'], route_info['end_date']) == \
+        ('Bellville', '20250113', '99999999')
+    assert [(name, list(minutes), list(notes)) for name, minutes, notes in stops] == \
+        [('BELLVILLE', [360, 960], [0, ord('b')]), ('CAPE TOWN', [420], [0])]
+    # Monday to Thursday share one partition; Friday adds the 'b' departure
+    assert [(weekdays, [(name, list(minutes)) for name, minutes, _ in day_stops]) for weekdays, day_stops in service] == [
+        ([0, 1, 2, 3], [('BELLVILLE', [360]), ('CAPE TOWN', [420])]),
+        ([4], [('BELLVILLE', [360, 960]), ('CAPE TOWN', [420])]),
+    ]
+
+
+def test_records_only_for_matching_signature(tmp_path):
+    snapshot = TimetableSnapshot(str(tmp_path / 'snapshot.bin'))
+    assert snapshot.gabs_records(['files', 1]) is None
+    snapshot.write([make_route()], ['files', 1], MYCITI, ['myciti', 1])
+    assert snapshot.gabs_records(['files', 2]) is None
+    assert snapshot.myciti_routes(['myciti', 2]) is None
+    assert snapshot.myciti_routes(['myciti', 1]) == MYCITI
+
+
+def test_update_gabs_keeps_myciti_routes(tmp_path):
+    snapshot = TimetableSnapshot(str(tmp_path / 'snapshot.bin'))
+    snapshot.write([make_route()], ['files', 1], MYCITI, ['myciti', 1])
+    snapshot.update_gabs([], ['files', 2])
+    assert snapshot.gabs_records(['files', 2]) == []
+    assert snapshot.myciti_routes(['myciti', 1]) == MYCITI
+
+
+def test_other_versions_are_not_read(tmp_path):
+    path = tmp_path / 'snapshot.bin'
+    TimetableSnapshot(str(path)).write([make_route()], ['files', 1])
+    data = bytearray(path.read_bytes())
+    TimetableSnapshot.HEADER.pack_into(data, 0, TimetableSnapshot.MAGIC, TimetableSnapshot.VERSION + 1,
+                                       *TimetableSnapshot.HEADER.unpack_from(data, 0)[2:])
+    path.write_bytes(bytes(data))
+    assert TimetableSnapshot(str(path)).gabs_records(['files', 1]) is None
+
+    path.write_bytes(b'SCRP')
+    assert TimetableSnapshot(str(path)).gabs_records(['files', 1]) is None
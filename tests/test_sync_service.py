@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+from sync_service import TimetableSync
+
+OLD = 'BELLVILLE___CAPE_TOWN_from_20240101_to_99999999_012001.pdf'
+CURRENT = 'BELLVILLE___CAPE_TOWN_from_20250113_to_99999999_012002.pdf'
+FUTURE = 'BELLVILLE___CAPE_TOWN_from_20250601_to_99999999_012001.pdf'
+# The same printing published under another corridor's name
+COPY = 'MOWBRAY___CAPE_TOWN_from_20250113_to_99999999_012001.pdf'
+EXPIRED = 'ATLANTIS___BELLVILLE_from_20240101_to_20241231_014401.pdf'
+
+
+class FakePDFService:
+    """The parts of PDFService that TimetableSync uses, over a local folder and a fixed listing."""
+
+    url = 'http://gabs.test/Timetable.aspx'
+
+    def __init__(self, download_folder, links):
+        self.download_folder = download_folder
+        self.links = links
+        self.downloader = self
+        self.downloaded = []
+
+    def fetch_pdf_links(self):
+        return self.links
+
+    def list_downloaded_pdfs(self):
+        return [f for f in os.listdir(self.download_folder) if not f.startswith('.')]
+
+    def download_all(self, urls, progress=None):
+        self.downloaded.extend(urls)
+        return {url: 'not_modified' for url in urls}
+
+
+def test_resolve_keeps_version_in_force_and_future_ones():
+    sync = TimetableSync(None)
+    active, superseded, withdrawn = sync.resolve([OLD, CURRENT, FUTURE, COPY, EXPIRED, 'notes.pdf'], today='20250301')
+    assert active == [CURRENT, FUTURE, 'notes.pdf']
+    assert superseded == [EXPIRED, OLD, COPY]
+    assert withdrawn == []
+
+
+def test_resolve_switches_to_future_version_on_its_date():
+    active, superseded, _ = TimetableSync(None).resolve([CURRENT, FUTURE], today='20250601')
+    assert active == [FUTURE]
+    assert superseded == [CURRENT]
+
+
+def test_resolve_withdraws_unpublished_files():
+    active, _, withdrawn = TimetableSync(None).resolve([OLD, CURRENT], published={CURRENT}, today='20250301')
+    assert active == [CURRENT]
+    assert withdrawn == [OLD]
+
+
+def test_sync_downloads_active_files_and_saves_manifest(tmp_path):
+    (tmp_path / OLD).write_bytes(b'%PDF')
+    links = [f'http://gabs.test/{name}' for name in (CURRENT, COPY)]
+    pdf_service = FakePDFService(str(tmp_path), links)
+    sync = TimetableSync(pdf_service)
+
+    report = sync.sync()
+    assert pdf_service.downloaded == [links[0]]
+    assert report['published'] == [CURRENT, COPY]
+    assert report['withdrawn'] == [OLD]
+    assert json.loads((tmp_path / TimetableSync.MANIFEST_FILE).read_text())['active'] == report['active']
+
+
+def test_sync_refuses_empty_listing(tmp_path):
+    (tmp_path / CURRENT).write_bytes(b'%PDF')
+    pdf_service = FakePDFService(str(tmp_path), [])
+    sync = TimetableSync(pdf_service)
+
+    with pytest.raises(RuntimeError):
+        sync.sync()
+    assert not (tmp_path / TimetableSync.MANIFEST_FILE).exists()
+    assert sync.active_files() == [CURRENT]
@@ -0,0 +1,30 @@
+from timetable_model import PlaceSuggestIndex
+
+NAMES = ['BELLVILLE', 'CAPE TOWN', 'AIRPORT IND 1', 'AIRPORT IND 2', 'KHAYELITSHA', 'TOWN CENTRE', 'Mamre (Paradise Rd']
+
+
+def test_suggest_prefix_of_whole_name():
+    assert PlaceSuggestIndex(NAMES).suggest('bel') == ['BELLVILLE']
+
+
+def test_suggest_whole_names_before_word_starts():
+    assert PlaceSuggestIndex(NAMES).suggest('town') == ['TOWN CENTRE', 'CAPE TOWN']
+
+
+def test_suggest_ignores_punctuation():
+    assert PlaceSuggestIndex(NAMES).suggest('mamre parad') == ['Mamre (Paradise Rd']
+
+
+def test_suggest_tolerates_a_typo():
+    assert PlaceSuggestIndex(NAMES).suggest('khayelitsa') == ['KHAYELITSHA']
+
+
+def test_suggest_no_near_matches_for_short_queries():
+    assert PlaceSuggestIndex(NAMES).suggest('bek') == []
+
+
+def test_suggest_limit():
+    index = PlaceSuggestIndex(NAMES)
+    assert index.suggest('airport', limit=1) == ['AIRPORT IND 1']
+    assert index.suggest('airport', limit=0) == []
+    assert index.suggest('  ') == []
@@ -0,0 +1,210 @@
+import heapq
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+
+TIME_PATTERN = re.compile(r'^(\d{1,2}):([0-5]\d)\s*([a-z]?)$')
+
+
+WEEKDAYS = ('MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY')
+
+# Days of the week (Monday = 0) covered by each service day heading in the GABS and MyCiti timetables
+DAY_HEADINGS = {
+    'MONDAYS TO FRIDAYS': (0, 1, 2, 3, 4),
+    'SATURDAYS': (5,),
+    'SUNDAYS': (6,),
+    'SUNDAYS AND PUBLIC HOLIDAYS': (6,),
+}
+
+
+def parse_weekdays(text):
+    """Parses a footnote like 'Mondays,Tuesdays' into the weekdays it names (Monday = 0)."""
+    names = {word.upper().rstrip('S') for word in re.split(r'[\s,]+', text) if word}
+    return tuple(i for i, name in enumerate(WEEKDAYS) if name in names)
+
+
+MONTHS = ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC')
+PRINTED_DATE_PATTERN = re.compile(r'(\d{4})[-/](\d{1,2})[-/](\d{1,2})|(\d{1,2})/(\d{1,2})/(\d{4})'
+                                  r'|(\d{1,2})\s+([A-Za-z]{3})[A-Za-z]*\s+(\d{4})')
+
+
+def parse_printed_date(text):
+    """Parses a printed date like '2025/01/13', '13/01/2025' or '13 January 2025' into 'YYYYMMDD', or None."""
+    match = PRINTED_DATE_PATTERN.fullmatch(text.strip())
+    if not match:
+        return None
+    if match.group(1):
+        year, month, day = match.group(1), match.group(2), match.group(3)
+    elif match.group(4):
+        day, month, year = match.group(4), match.group(5), match.group(6)
+    else:
+        month = match.group(8).upper()
+        if month not in MONTHS:
+            return None
+        day, month, year = match.group(7), MONTHS.index(month) + 1, match.group(9)
+    if not (1 <= int(month) <= 12 and 1 <= int(day) <= 31):
+        return None
+    return f"{int(year):04d}{int(month):02d}{int(day):02d}"
+
+
+def normalize_place(name):
+    return ' '.join(name.split()).upper()
+
+
+def search_key(name):
+    """Normalizes a place name or typed query for matching: 'A.D.E.' -> 'ADE', 'Mamre (Paradise Rd' -> 'MAMRE PARADISE RD'."""
+    return ' '.join(re.sub(r'[^0-9A-Z\s]', '', name.upper()).split())
+
+
+def parse_time(value):
+    """Parses a timetable cell like '07:05b' into (minutes since midnight, note), or None."""
+    match = TIME_PATTERN.match(value.strip())
+    if not match:
+        return None
+    return int(match.group(1)) * 60 + int(match.group(2)), match.group(3)
+
+
+def format_time(minutes, note=''):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}{note}"
+
+
+class PlaceTable:
+    """Interns place names to small integer ids shared by every route."""
+
+    __slots__ = ('names', 'ids')
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        key = normalize_place(name)
+        place_id = self.ids.get(key)
+        if place_id is None:
+            place_id = self.ids[key] = len(self.names)
+            self.names.append(name.strip())
+        return place_id
+
+    def id_of(self, name):
+        return self.ids.get(normalize_place(name))
+
+    def name_of(self, place_id):
+        return self.names[place_id]
+
+
+class StopTimes:
+    """Departures of one route at one place as sorted minutes since midnight.
+
+    `notes` runs parallel to `minutes` and holds the ordinal of the footnote
+    letter printed next to a time (e.g. the 'a' in '07:05a'), or 0.
+    """
+
+    __slots__ = ('place_id', 'minutes', 'notes')
+
+    def __init__(self, place_id, minutes=None, notes=None):
+        self.place_id = place_id
+        self.minutes = minutes if minutes is not None else array('H')
+        self.notes = notes if notes is not None else array('B')
+
+    @classmethod
+    def from_strings(cls, place_id, values):
+        """Builds sorted, de-duplicated departures from raw cells, dropping 'via' and '--' entries."""
+        departures = set()
+        for value in values:
+            parsed = parse_time(value)
+            if parsed:
+                departures.add((parsed[0], ord(parsed[1]) if parsed[1] else 0))
+        return cls.from_departures(place_id, departures)
+
+    @classmethod
+    def from_departures(cls, place_id, departures):
+        """Builds the departures from (minutes, note ordinal) pairs, sorting and de-duplicating them."""
+        departures = sorted(set(departures))
+        return cls(place_id, array('H', (m for m, _ in departures)), array('B', (n for _, n in departures)))
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def window(self, after=None, before=None, limit=None):
+        """Returns the (start, stop) slice of departures between after and before (inclusive, in minutes)."""
+        start = bisect_left(self.minutes, after) if after is not None else 0
+        stop = bisect_right(self.minutes, before) if before is not None else len(self.minutes)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return start, max(start, stop)
+
+    def formatted(self, start=0, stop=None):
+        """Returns the departures in [start:stop] as 'HH:MM' strings with their footnote letter."""
+        stop = len(self.minutes) if stop is None else stop
+        return [format_time(self.minutes[i], chr(self.notes[i]) if self.notes[i] else '') for i in range(start, stop)]
+
+
+class PlaceSuggestIndex:
+    """Autocomplete over place names, built once per set of places.
+
+    Prefix matches come from sorted keys found by bisection, first on the
+    whole name and then on any word in it. When they do not fill the
+    requested number, names sharing enough trigrams with the query are added,
+    which tolerates a mistyped or missing letter.
+    """
+
+    __slots__ = ('names', 'keys', 'word_keys', 'trigrams')
+
+    # Share of the query's trigrams a name must contain to be suggested as a near match
+    MIN_SIMILARITY = 0.6
+
+    def __init__(self, names):
+        self.names = sorted(set(names), key=lambda name: (search_key(name), name))
+        # (key, name id) sorted by key, for the whole names and for every word start after the first
+        self.keys = [(search_key(name), name_id) for name_id, name in enumerate(self.names)]
+        self.word_keys = sorted((key[start + 1:], name_id) for key, name_id in self.keys
+                                for start, char in enumerate(key) if char == ' ')
+        # trigram -> ids of the names containing it
+        self.trigrams = {}
+        for key, name_id in self.keys:
+            for gram in set(self.grams(key)):
+                self.trigrams.setdefault(gram, array('H')).append(name_id)
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def grams(key):
+        # Padded in front only: a query is usually the start of a name
+        padded = f'  {key}'
+        return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    def suggest(self, query, limit=10):
+        """Returns at most limit place names for the typed query, best matches first."""
+        key = search_key(query)
+        if not key or limit < 1:
+            return []
+
+        found = []
+        seen = set()
+        for keys in (self.keys, self.word_keys):
+            i = bisect_left(keys, (key,))
+            while i < len(keys) and len(found) < limit and keys[i][0].startswith(key):
+                name_id = keys[i][1]
+                if name_id not in seen:
+                    seen.add(name_id)
+                    found.append(name_id)
+                i += 1
+
+        # Too few trigrams in shorter queries to tell a typo from another name
+        if len(found) < limit and len(key) >= 4:
+            query_grams = set(self.grams(key))
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.trigrams.get(gram, ()))
+            needed = self.MIN_SIMILARITY * len(query_grams)
+            near = ((-count, len(self.keys[name_id][0]), name_id) for name_id, count in shared.items()
+                    if count >= needed and name_id not in seen)
+            found.extend(name_id for _, _, name_id in heapq.nsmallest(limit - len(found), near))
+
+        return [self.names[name_id] for name_id in found]